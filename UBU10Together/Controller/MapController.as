@@ -12,7 +12,13 @@ class MapController {
         //trace("[MapController] Fetching UBU10 maps from Firebase");
         
         try {
-            dictionary@ allData = FirebaseClient::GetAllMedalData();
+            dictionary@ allData = null;
+            if (FirebaseClient::HasBundle()) {
+                // The session-start bundle already holds every map
+                @allData = FirebaseClient::g_medalCache;
+            } else {
+                @allData = FirebaseClient::GetAllMedalData();
+            }
             
             if (allData is null) {
                 warn("[MapController] Failed to fetch map data from Firebase");
@@ -81,6 +81,9 @@ class UBU10Controller {
 
         ClearMapsFolder();
         LoadSettings();
+        if (!FirebaseClient::LoadBundle()) {
+            trace("[UBU10] No medal bundle - medal data will be fetched per map");
+        }
         if (!mapController.LoadMapList()) {
             warn("[UBU10] Failed to load map list");
             return;
@@ -5,6 +5,8 @@ namespace FirebaseClient {
     string FIREBASE_AUTH_TOKEN = "";
     dictionary g_medalCache;
     bool g_cacheEnabled = true;
+    string g_bundleVersion = "";
+    const int BUNDLE_FORMAT = 1;
     
     void SetFirebaseUrl(const string &in url) {
         FIREBASE_BASE_URL = url;
@@ -16,6 +18,129 @@ namespace FirebaseClient {
     
     void ClearCache() {
         g_medalCache.DeleteAll();
+        g_bundleVersion = "";
+    }
+    
+    bool HasBundle() {
+        return g_bundleVersion.Length > 0;
+    }
+    
+    MedalData@ GetCachedMedalData(const string &in mapUid) {
+        if (!g_medalCache.Exists(mapUid)) return null;
+        MedalData@ cached;
+        g_medalCache.Get(mapUid, @cached);
+        return cached;
+    }
+    
+    // The generator publishes the bundle as a sibling node: .../ubu10/ -> .../ubu10_bundle
+    string BundleUrl() {
+        string base = FIREBASE_BASE_URL;
+        if (base.EndsWith("/")) base = base.SubStr(0, base.Length - 1);
+        return base + "_bundle";
+    }
+    
+    Json::Value@ FetchJson(const string &in path, int timeoutMs) {
+        string url = path;
+        if (FIREBASE_AUTH_TOKEN.Length > 0) {
+            url += "?auth=" + FIREBASE_AUTH_TOKEN;
+        }
+        
+        Net::HttpRequest@ req = Net::HttpGet(url);
+        
+        int startTime = Time::Now;
+        while (!req.Finished()) {
+            yield();
+            if (Time::Now - startTime > timeoutMs) {
+                warn("[Firebase] Request timeout for: " + path);
+                return null;
+            }
+        }
+        
+        if (req.ResponseCode() != 200) {
+            warn("[Firebase] HTTP " + req.ResponseCode() + " for: " + path);
+            return null;
+        }
+        
+        return Json::Parse(req.String());
+    }
+    
+    // Load every map's medal data into g_medalCache in one step at session start.
+    // Returns true when a current bundle is loaded; GetMedalData then never goes to the network.
+    bool LoadBundle() {
+        try {
+            Json::Value@ remote = FetchJson(BundleUrl() + "/version.json", 10000);
+            if (remote !is null && remote.GetType() != Json::Type::String) {
+                // Reachable, but nothing published for this node
+                return false;
+            }
+            string remoteVersion = remote !is null ? string(remote) : "";
+            if (remoteVersion.Length > 0 && remoteVersion == g_bundleVersion) {
+                return true;
+            }
+            
+            // A stored bundle is used when it is current, or when Firebase is unreachable
+            string path = IO::FromStorageFolder(UBU10Files::Bundle);
+            if (IO::FileExists(path)) {
+                Json::Value@ stored = Json::FromFile(path);
+                if (stored !is null && stored.GetType() == Json::Type::Object && stored.HasKey("version")
+                    && (remoteVersion.Length == 0 || string(stored["version"]) == remoteVersion)
+                    && ApplyBundle(stored)) {
+                    return true;
+                }
+            }
+            if (remoteVersion.Length == 0) {
+                return false;
+            }
+            
+            Json::Value@ bundle = FetchJson(BundleUrl() + ".json", 30000);
+            if (!ApplyBundle(bundle)) {
+                return false;
+            }
+            Json::ToFile(path, bundle);
+            return true;
+            
+        } catch {
+            warn("[Firebase] Exception loading bundle: " + getExceptionInfo());
+            return false;
+        }
+    }
+    
+    bool ApplyBundle(Json::Value@ bundle) {
+        if (bundle is null || bundle.GetType() != Json::Type::Object) {
+            warn("[Firebase] Invalid bundle");
+            return false;
+        }
+        if (!bundle.HasKey("format") || int(bundle["format"]) != BUNDLE_FORMAT) {
+            warn("[Firebase] Unsupported bundle format");
+            return false;
+        }
+        
+        // The payload is a JSON string so its checksum survives Firebase re-serializing the bundle
+        string payload = string(bundle["payload"]);
+        if (Crypto::Sha256(payload) != string(bundle["sha256"])) {
+            warn("[Firebase] Bundle checksum mismatch");
+            return false;
+        }
+        
+        Json::Value@ maps = Json::Parse(payload);
+        if (maps is null || maps.GetType() != Json::Type::Object) {
+            warn("[Firebase] Invalid bundle payload");
+            return false;
+        }
+        
+        dictionary loaded;
+        auto keys = maps.GetKeys();
+        for (uint i = 0; i < keys.Length; i++) {
+            MedalData@ medalData = MedalData(maps[keys[i]]);
+            if (medalData.IsValid()) {
+                loaded.Set(keys[i], @medalData);
+            }
+        }
+        
+        g_medalCache = loaded;
+        g_bundleVersion = string(bundle["version"]);
+        trace("[Firebase] Loaded medal bundle " + g_bundleVersion + " (" + loaded.GetSize() + " maps)");
+        return true;
     }
     
     MedalData@ GetMedalData(const string &in mapUid) {
@@ -29,6 +154,12 @@ namespace FirebaseClient {
             g_medalCache.Get(mapUid, @cached);
             return cached;
         }
+        
+        // A current bundle has every published map; one it lacks has no data to fetch
+        if (HasBundle()) {
+            warn("[Firebase] No bundled data for: " + mapUid);
+            return null;
+        }
                 
         string url = FIREBASE_BASE_URL + mapUid + ".json";
         if (FIREBASE_AUTH_TOKEN.Length > 0) {
@@ -3,5 +3,6 @@ namespace UBU10Files {
     const string PlayerInfo = "UBU10_PlayerInfo.json";
     const string Targets = "UBU10_targets.json";
     const string MapInfo = "UBU10_MapInfo.json";
+    const string Bundle = "UBU10_bundle.json";
     const string FirebaseUrl = "https://ubu10together-default-rtdb.europe-west1.firebasedatabase.app/ubu10/"; // use /school/ for testing and /ubu10/ for production
 }
@@ -133,7 +133,14 @@ class MedalOverlay {
         
         if (currentMapUid.Length == 0) return;
         
-        string url = UBU10Files::FirebaseUrl + currentMapUid + ".json"; 
+        // Bundled or already fetched by the controller: no request needed
+        MedalData@ cached = FirebaseClient::GetCachedMedalData(currentMapUid);
+        if (cached !is null || FirebaseClient::HasBundle()) {
+            @currentMedalData = cached;
+            return;
+        }
+        
+        string url = FirebaseClient::FIREBASE_BASE_URL + currentMapUid + ".json"; 
         @pendingRequest = Net::HttpGet(url);
     }
     
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import generate_times as gt
+import times_net
+import standin_server as ss
+
+
+class TimedPool(times_net.HttpPool):
+    """HttpPool that records the client-side latency of every request."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.latencies: List[float] = []
+        self._lat_lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs: Any):
+        t0 = time.perf_counter()
+        try:
+            return super().request(method, url, **kwargs)
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lat_lock:
+                self.latencies.append(dt)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _summarize(name: str, elapsed: float, n_maps: int, pool: TimedPool, server_counts: Dict[str, int]) -> Dict[str, Any]:
+    sent = len(pool.latencies)
+    return {
+        "benchmark": name,
+        "maps": n_maps,
+        "elapsed_s": round(elapsed, 3),
+        "maps_per_s": round(n_maps / elapsed, 2) if elapsed > 0 else 0.0,
+        "requests": sent,
+        "requests_per_map": round(sent / n_maps, 2) if n_maps else 0.0,
+        "latency_p50_ms": round(percentile(pool.latencies, 50) * 1000, 1),
+        "latency_p99_ms": round(percentile(pool.latencies, 99) * 1000, 1),
+        "server_requests": dict(sorted(server_counts.items())),
+    }
+
+
+class StandIns:
+    """TMX and TMIO stand-ins on separate ports, so they count as distinct hosts as in production."""
+
+    def __init__(self, recording: ss.Recording, faults: ss.FaultConfig):
+        self.handlers = [ss.make_trackmania_handler(recording, faults) for _ in range(2)]
+        self.servers = [ss.serve(h) for h in self.handlers]
+
+    @property
+    def tmx_base(self) -> str:
+        return f"http://127.0.0.1:{self.servers[0].server_port}"
+
+    @property
+    def tmio_base(self) -> str:
+        return f"http://127.0.0.1:{self.servers[1].server_port}"
+
+    def reset_counts(self) -> None:
+        for h in self.handlers:
+            h.request_counts.clear()
+
+    def counts(self) -> Dict[str, int]:
+        """Requests per endpoint, with per-map paths collapsed to `/{id}`."""
+        buckets: Dict[str, int] = {}
+        for h in self.handlers:
+            for path, n in h.request_counts.items():
+                key = path.rsplit("/", 1)[0] + "/{id}" if path.count("/") > 2 else path
+                buckets[key] = buckets.get(key, 0) + n
+        return buckets
+
+    def shutdown(self) -> None:
+        for s in self.servers:
+            s.shutdown()
+
+
+def _fresh_pool(workers: int) -> TimedPool:
+    times_net._POOL.close()
+    times_net._POOL = TimedPool(10, max(10, workers))
+    return times_net._POOL
+
+
+def bench_fetch_maps(stand_ins: StandIns, author: str, prefix: str, max_maps: int) -> Dict[str, Any]:
+    pool = _fresh_pool(1)
+    stand_ins.reset_counts()
+    t0 = time.perf_counter()
+    maps = list(times_net.fetch_maps(author, prefix, "TMX-Times-Bench/1.0", max_maps))
+    return _summarize("fetch_maps", time.perf_counter() - t0, len(maps), pool, stand_ins.counts())
+
+
+def bench_main(stand_ins: StandIns, author: str, prefix: str, max_maps: int, workers: int, extra: List[str]) -> Dict[str, Any]:
+    pool = _fresh_pool(workers)
+    stand_ins.reset_counts()
+    fd, out_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    argv = [
+        "--author", author,
+        "--prefix", prefix,
+        "--max-maps", str(max_maps),
+        "--workers", str(workers),
+        "--out", out_path,
+    ] + extra
+    # main() configures its own pool; keep the timed one in place for the run
+    orig_configure = gt.configure_pool
+    gt.configure_pool = lambda *a, **k: pool
+    try:
+        t0 = time.perf_counter()
+        gt.main(argv)
+        elapsed = time.perf_counter() - t0
+    finally:
+        gt.configure_pool = orig_configure
+    with open(out_path, "r", encoding="utf-8") as f:
+        n_maps = len(json.load(f).get("maps") or [])
+    os.remove(out_path)
+    return _summarize(f"main(workers={workers})", elapsed, n_maps, pool, stand_ins.counts())
+
+
+def record(author: str, prefix: str, max_maps: int, user_agent: str, path: str) -> int:
+    """Capture live TMX/TMIO responses for a campaign into a Recording file for offline runs."""
+    maps = list(times_net.fetch_maps(author, prefix, user_agent, max_maps))
+    data: Dict[str, Any] = {"maps": maps, "leaderboards": {}, "authorTimes": {}, "replays": {}}
+    for m in maps:
+        uid = m.get("MapUid") or m.get("TrackUID")
+        if not uid:
+            continue
+        data["leaderboards"][uid] = times_net.fetch_tmio_leaderboard(uid, user_agent, 50)
+        at = times_net.fetch_tmio_author_time(uid, user_agent)
+        if at is not None:
+            data["authorTimes"][uid] = at
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    print(f"Recorded {len(maps)} map(s) to {path}", file=sys.stderr)
+    return 0
+
+
+def _format(r: Dict[str, Any]) -> str:
+    return (
+        f"{r['benchmark']:<20} {r['maps']:>5} maps  {r['elapsed_s']:>8.3f}s  {r['maps_per_s']:>8.2f} maps/s  "
+        f"{r['requests_per_map']:>6.2f} req/map  p50 {r['latency_p50_ms']:>7.1f}ms  p99 {r['latency_p99_ms']:>7.1f}ms"
+    )
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="Offline throughput benchmark for generate_times against local TMX/TMIO stand-ins")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--recording", default=None, help="Recording JSON served by the stand-in (see standin_server.Recording)")
+    src.add_argument("--synthetic", type=int, default=100, help="Synthetic campaign size when no recording is given")
+    ap.add_argument("--author", default="uncleblowtorch")
+    ap.add_argument("--prefix", default="UBU")
+    ap.add_argument("--max-maps", type=int, default=100)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Worker counts to benchmark main() with")
+    ap.add_argument("--latency", type=float, default=0.02, help="Stand-in base latency (s)")
+    ap.add_argument("--jitter", type=float, default=0.01, help="Stand-in random extra latency (s)")
+    ap.add_argument("--p429", type=float, default=0.0)
+    ap.add_argument("--p5xx", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=None)
+    ap.add_argument("--seed", type=int, default=0, help="Seed for fault injection")
+    ap.add_argument("--rate", type=float, default=0.0, help="Per-host rate passed to main(); 0 measures raw pipeline throughput")
+    ap.add_argument("--json", default=None, help="Also write results as JSON here")
+    ap.add_argument("--record", default=None, help="Record live TMX/TMIO responses to this file instead of benchmarking")
+    args, extra = ap.parse_known_args(argv)
+
+    if args.record:
+        return record(args.author, args.prefix, args.max_maps, "TMX-Times-Bench/1.0", args.record)
+
+    recording = ss.Recording.load(args.recording) if args.recording else ss.Recording.synthetic(args.synthetic, args.author, args.prefix)
+    faults = ss.FaultConfig(args.latency, args.jitter, args.p429, args.p5xx, args.retry_after, args.seed)
+    stand_ins = StandIns(recording, faults)
+    orig_tmx, orig_tmio = times_net.TMX_BASE, times_net.TMIO_BASE
+    times_net.TMX_BASE, times_net.TMIO_BASE = stand_ins.tmx_base, stand_ins.tmio_base
+    times_net.configure_limiter(args.rate)
+    results: List[Dict[str, Any]] = []
+    try:
+        results.append(bench_fetch_maps(stand_ins, args.author, args.prefix, args.max_maps))
+        for w in args.workers:
+            main_extra = ["--rate", str(args.rate)] + extra
+            results.append(bench_main(stand_ins, args.author, args.prefix, args.max_maps, w, main_extra))
+    finally:
+        times_net.TMX_BASE, times_net.TMIO_BASE = orig_tmx, orig_tmio
+        stand_ins.shutdown()
+
+    for r in results:
+        print(_format(r))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
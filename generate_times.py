@@ -1,494 +1,783 @@
 import argparse
+import hashlib
+import heapq
 import json
+import os
 import sys
-from datetime import datetime
-from typing import Any, Dict, List, Optional
-
-import requests
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import times_core
+import times_net
+from times_core import (
+    AUTHOR_TIME_SOURCES,
+    Leaderboard,
+    MapRecord,
+    MedalEngine,
+    Pipeline,
+    SnapshotStore,
+    build_entry,
+    configure_author_time,
+    configure_hedging,
+    configure_leaderboard,
+    configure_map_timings,
+    configure_snapshots,
+    configure_sparse_retries,
+    leaderboard_hash,
+    leaderboard_settings,
+    medal_engine,
+    merge_entries,
+    ordered_map,
+    snapshot_hook,
+    snapshot_store,
+    verify_author_times,
+)
+from times_net import (
+    FetchError,
+    configure_breaker,
+    configure_cache,
+    configure_limiter,
+    configure_pool,
+    configure_shared_memo,
+    configure_strategy_memo,
+    fetch_maps,
+    pool_stats,
+    reset_metrics,
+)
+from times_output import (
+    StreamWriter,
+    audit_document,
+    bundle_document,
+    diff_summary,
+    document_from_stream,
+    fetch_node,
+    load_previous,
+    publish_bundle,
+    publish_entries,
+    published_document,
+    slim_document,
+    write_bundle,
+    write_document,
+    write_slim,
+)
 import time
 
 
-def http_get(url: str, params: Dict[str, Any], user_agent: str) -> Dict[str, Any]:
-    headers = {"User-Agent": user_agent}
-    last_exc: Optional[Exception] = None
-    for attempt in range(4):
-        try:
-            r = requests.get(url, params=params, headers=headers, timeout=30)
-            if r.status_code == 429:
-                retry_after = r.headers.get("Retry-After")
-                # Respect server-provided backoff if available
-                if retry_after is not None:
-                    try:
-                        time.sleep(min(10.0, float(retry_after)))
-                    except Exception:
-                        time.sleep(1.0)
-                raise requests.HTTPError("429")
-            if 500 <= r.status_code < 600:
-                raise requests.HTTPError(f"{r.status_code}")
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            last_exc = e
-            if attempt == 3:
-                raise
-            delay = min(5.0, 0.5 * (2 ** attempt))
-            time.sleep(delay)
-    raise last_exc if last_exc else RuntimeError("http_get failed")
-
-
-def fetch_maps(author: str, prefix: str, user_agent: str, count: int = 100) -> List[Dict[str, Any]]:
-    pfx = prefix.lower()
-    auth_lower = author.lower()
-
-    # Primary: TMX v2 /api/maps with cursor pagination (after)
-    url = "https://trackmania.exchange/api/maps"
-    # Be conservative with page size; docs default is 40.
-    per_page = min(max(1, int(count)), 100)
-    # Use explicit nested paths for required fields per API docs
-    fields = (
-        "MapId,MapUid,Name,Uploader.Name,Medals.Author,ReplayCount"
+def cmd_finalize(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="generate_times.py finalize", description="Build the output JSON from an NDJSON stream")
+    ap.add_argument("stream")
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args(argv)
+    write_document(document_from_stream(args.stream), args.out)
+    return 0
+
+
+def add_network_args(ap: argparse.ArgumentParser) -> None:
+    """Options for the shared HTTP layer (limiter, retries, pool, cache, metrics), common to all run modes."""
+    ap.add_argument("--user-agent", default="TMX-Times-Generator/1.0")
+    ap.add_argument("--workers", type=int, default=1, help="Maps processed concurrently (default: 1, sequential)")
+    ap.add_argument("--rate", type=float, default=6.0, help="Max requests/s per host, shared by all workers (0 = unlimited)")
+    ap.add_argument("--burst", type=float, default=2.0, help="Requests per host allowed back-to-back before the rate applies")
+    ap.add_argument("--retries", type=int, default=4, help="Attempts per request (network errors, 429, 5xx, empty payloads)")
+    ap.add_argument(
+        "--breaker-threshold",
+        type=float,
+        default=0.5,
+        help="Failure rate over a host's recent requests that opens its circuit and fails the rest fast (0 = off)",
     )
-    collected: List[Dict[str, Any]] = []
-    after: Optional[int] = None
-    while True:
-        params: Dict[str, Any] = {
-            "fields": fields,
-            "name": prefix,
-            "count": str(per_page),
-        }
-        if after is not None:
-            params["after"] = str(after)
-        data = http_get(url, params, user_agent)
-        results = data.get("Results") or data.get("results") or []
-        if not isinstance(results, list) or len(results) == 0:
-            break
-        collected.extend(results)
-        # Prepare next cursor
-        last = results[-1].get("MapId") or results[-1].get("TrackId")
-        if last is None:
-            break
-        try:
-            after = int(last)
-        except (TypeError, ValueError):
-            break
-        if data.get("More") is False:
-            break
-
-    # Client-side strict filtering
-    filtered: List[Dict[str, Any]] = []
-    for m in collected:
-        name_val = m.get("Name") or m.get("TrackName") or ""
-        uploader = m.get("Uploader") or {}
-        username_val = m.get("Username") or uploader.get("Name") or ""
-        authors_arr = m.get("Authors") or []
-        has_author_match = username_val.lower() == auth_lower
-        if not has_author_match:
-            for a in authors_arr:
-                auser = a.get("User") if isinstance(a, dict) else None
-                aname = (auser or {}).get("Name") if isinstance(auser, dict) else a.get("Name")
-                if isinstance(aname, str) and aname.lower() == auth_lower:
-                    has_author_match = True
-                    break
-        if not name_val:
-            continue
-        if not name_val.lower().startswith(pfx):
-            continue
-        if not has_author_match:
+    ap.add_argument("--breaker-cooldown", type=float, default=30.0, help="Seconds an open circuit waits before one probe request")
+    ap.add_argument("--pool-size", type=int, default=None, help="Keep-alive connections per host (default: max(10, workers))")
+    ap.add_argument("--pool-hosts", type=int, default=10, help="Number of per-host connection pools to keep")
+    ap.add_argument("--cache-dir", default=None, help="Enable the on-disk HTTP response cache in this directory")
+    ap.add_argument("--max-age", type=float, default=None, help="Override every per-endpoint cache TTL (seconds)")
+    ap.add_argument("--cache-max-mb", type=float, default=256, help="Evict old cache entries beyond this size")
+    ap.add_argument("--metrics", default=None, help="Write per-endpoint request metrics as JSON here")
+    ap.add_argument("--metrics-prom", default=None, help="Write the same metrics in Prometheus text format here")
+
+
+def add_leaderboard_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--depth", type=int, default=50, help="Leaderboard records fetched per map; deeper boards are paged 100 at a time")
+    ap.add_argument("--time-a-n", type=int, default=50, help="Top records Time_A averages over (maps with fewer use Time_B)")
+    ap.add_argument("--sparse-retries", type=int, default=2, help="Deferred refetch rounds for sparse or AT-less maps (0 = off)")
+    ap.add_argument("--sparse-retry-delay", type=float, default=1.0, help="Wait before the first deferred round; doubles per round")
+    ap.add_argument(
+        "--hedge-after",
+        type=float,
+        default=None,
+        help="Seconds to wait on TMIO before also trying TMX replays (also tried on sparse boards); first acceptable wins",
+    )
+    ap.add_argument(
+        "--author-time",
+        choices=AUTHOR_TIME_SOURCES,
+        default="tmx",
+        help="tmx: TMX Medals.Author, TMIO only when missing; tmio: always TMIO; verify: tmx plus a batched TMIO check",
+    )
+
+
+def check_leaderboard_args(ap: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.depth < 1 or args.time_a_n < 1:
+        ap.error("--depth and --time-a-n must be positive")
+    if args.time_a_n > args.depth:
+        ap.error("--time-a-n cannot exceed --depth, or Time_A would never apply")
+    if args.hedge_after is not None and args.hedge_after < 0:
+        ap.error("--hedge-after cannot be negative")
+
+
+def configure_network(args: argparse.Namespace, concurrency: Optional[int] = None) -> None:
+    configure_limiter(args.rate, args.burst, args.retries)
+    configure_breaker(args.breaker_threshold, args.breaker_cooldown)
+    configure_cache(args.cache_dir, args.max_age, args.cache_max_mb)
+    if args.cache_dir:
+        configure_strategy_memo(os.path.join(args.cache_dir, "search_strategies.json"))
+    configure_pool(args.pool_hosts, args.pool_size or max(10, concurrency or args.workers))
+    reset_metrics()
+
+
+def print_missing(out: Dict[str, Any]) -> None:
+    missing = out.get("missing") or []
+    if not missing:
+        return
+    print(f"Partial result: {len(missing)} map(s) missing, {len(out['maps'])} computed", file=sys.stderr)
+    for m in missing:
+        print(f"  ? {m.get('name')} ({m['uid']}): {m['reason']}", file=sys.stderr)
+
+
+def write_metrics(json_path: Optional[str], prom_path: Optional[str]) -> None:
+    if json_path:
+        snap = times_net.METRICS.snapshot()
+        snap["pool"] = pool_stats()
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(snap, f, indent=2)
+    if prom_path:
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(times_net.METRICS.prometheus())
+
+
+def print_http_stats() -> None:
+    st = pool_stats()
+    print(
+        f"HTTP: {st['requests']} request(s) over {st['connections']} connection(s), "
+        f"{st['reused']} reused ({st['reuse_ratio']:.0%})",
+        file=sys.stderr,
+    )
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """argparse type for --shard: "i/N" with 1 <= i <= N."""
+    try:
+        i, n = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {text!r}")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"shard {text} out of range, need 1 <= i <= N")
+    return i, n
+
+
+def shard_of(uid: str, count: int) -> int:
+    """1-based shard a map UID belongs to: stable across processes, machines and discovery order."""
+    return int(hashlib.sha1(uid.encode("utf-8")).hexdigest()[:8], 16) % count + 1
+
+
+def _sharded(maps: Iterable[Dict[str, Any]], shard: Tuple[int, int], seen: List[MapRecord]) -> Iterator[Dict[str, Any]]:
+    """Pass through the maps of `shard`, recording every discovered map in `seen`."""
+    index, count = shard
+    for m in maps:
+        rec = MapRecord.from_tmx(m)
+        if rec is None:
             continue
-        filtered.append(m)
-
-    if filtered:
-        return filtered
-
-    # Fallback: legacy mapsearch2 variants
-    legacy_url = "https://trackmania.exchange/mapsearch2/search"
-    out: List[Dict[str, Any]] = []
-    name_keys = ["name", "mapname", "trackname"]
-    for nk in name_keys:
-        page = 1
-        got_any = False
-        while True:
-            params = {
-                "api": "on",
-                "author": author,
-                nk: prefix,
-                "page": str(page),
-                "length": str(per_page),
-            }
-            data = http_get(legacy_url, params, user_agent)
-            results = data.get("results", [])
-            if not results:
-                break
-            for m in results:
-                name_val = m.get("Name", "")
-                username_val = m.get("Username", "")
-                if not name_val or not username_val:
-                    continue
-                if not name_val.lower().startswith(pfx):
-                    continue
-                if username_val.lower() != auth_lower:
-                    continue
-                out.append(m)
-                got_any = True
-            page += 1
-            total = data.get("totalItemCount")
-            if isinstance(total, int) and len(out) >= total:
-                break
-        if got_any:
-            break
-
-    if out:
-        return out
-
-    # Final fallback: legacy with 'count'
-    for nk in name_keys:
-        page = 1
-        while True:
-            params = {
-                "api": "on",
-                "author": author,
-                nk: prefix,
-                "page": str(page),
-                "count": str(per_page),
-            }
-            data = http_get(legacy_url, params, user_agent)
-            results = data.get("results", [])
-            if not results:
-                break
-            for m in results:
-                name_val = m.get("Name", "")
-                username_val = m.get("Username", "")
-                if not name_val or not username_val:
-                    continue
-                if not name_val.lower().startswith(pfx):
-                    continue
-                if username_val.lower() != auth_lower:
-                    continue
-                out.append(m)
-            page += 1
-            total = data.get("totalItemCount")
-            if isinstance(total, int) and len(out) >= total:
-                break
-        if out:
-            break
-    return out
+        seen.append(rec)
+        if shard_of(rec.uid, count) == index:
+            yield m
 
 
-def fetch_replays(
-    track_id: int,
+def shard_block(shard: Tuple[int, int], seen: List[MapRecord]) -> Dict[str, Any]:
+    """What `merge` needs from a shard output: its position and the full discovery order."""
+    return {"index": shard[0], "count": shard[1], "order": [rec.uid for rec in seen]}
+
+
+def generate_document(
+    author: str,
+    prefix: str,
     user_agent: str,
-    per_page: int = 200,
-) -> List[Dict[str, Any]]:
-    """Fetch all replays for a map, using best=1 to get leaderboard (Position field)."""
-    url = "https://trackmania.exchange/api/replays"
-    base_params = {
-        "mapId": str(track_id),
-        "count": str(per_page),
-        "best": "1",  # Get best replay per user (leaderboard)
+    max_maps: int = 0,
+    workers: int = 1,
+    previous: Optional[Dict[str, Dict[str, Any]]] = None,
+    shard: Optional[Tuple[int, int]] = None,
+) -> Dict[str, Any]:
+    """Discover maps and compute every entry: the in-memory form of a regular run.
+
+    Maps are computed as the search yields them, so the first leaderboards are fetched
+    while later search pages are still loading. With `shard` (i, N), every map is still
+    discovered but only those `shard_of` assigns to shard i are computed. When `max_maps`
+    cut the search short, the limit is recorded as "truncated".
+    """
+    out: Dict[str, Any] = {
+        "author": author,
+        "prefix": prefix,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "maps": [],
     }
-    collected: List[Dict[str, Any]] = []
-    after: Optional[int] = None
-    while True:
-        params = dict(base_params)
-        if after is not None:
-            params["after"] = str(after)
-        data = http_get(url, params, user_agent)
-        page = data.get("Results", [])
-        if page:
-            collected.extend(page)
-            last = page[-1].get("ReplayId")
-        else:
-            last = None
-        more = data.get("More", False)
-        if not more or not page or last is None:
-            break
-        try:
-            after = int(last)
-        except (TypeError, ValueError):
-            break
-    return collected
-
-
-def fetch_replays_fallback_get(track_id: int, user_agent: str, amount: int = 25) -> List[Dict[str, Any]]:
-    """Fallback to legacy endpoint to at least get top N replays if /api/replays yields none."""
-    url = f"https://trackmania.exchange/api/replays/get_replays/{track_id}"
-    params = {"amount": str(amount)}
-    data = http_get(url, params, user_agent)
-    if isinstance(data, list):
-        return data
-    return []
-
-
-def fetch_tmio_leaderboard(uid: str, user_agent: str, length: int = 50) -> List[Dict[str, Any]]:
-    """Fetch top N records from trackmania.io leaderboard for a map UID, with retries if empty."""
-    url = f"https://trackmania.io/api/leaderboard/map/{uid}"
-    params = {"offset": "0", "length": str(max(1, min(length, 200)))}
-    for attempt in range(4):
-        try:
-            data = http_get(url, params, user_agent)
-        except Exception:
-            if attempt == 3:
-                return []
-            time.sleep(min(2.0, 0.5 * (2 ** attempt)))
-            continue
-        tops = data.get("tops") if isinstance(data, dict) else []
-        if isinstance(tops, list) and len(tops) > 0:
-            return tops
-        # Empty payload; back off and retry
-        if attempt < 3:
-            time.sleep(min(2.0, 0.5 * (2 ** attempt)))
-    return []
-
-
-def fetch_tmio_author_time(uid: str, user_agent: str) -> Optional[int]:
-    """Fetch author time (authorScore) in ms from trackmania.io for a map UID, with retries if missing."""
-    url = f"https://trackmania.io/api/map/{uid}"
-    for attempt in range(4):
-        try:
-            data = http_get(url, {}, user_agent)
-        except Exception:
-            if attempt == 3:
-                return None
-            time.sleep(min(2.0, 0.5 * (2 ** attempt)))
-            continue
-        val = data.get("authorScore") if isinstance(data, dict) else None
+    pipeline = Pipeline(user_agent, workers, previous)
+    seen: List[MapRecord] = []
+
+    def cut(limit: int) -> None:
+        out["truncated"] = limit
+
+    maps = fetch_maps(author, prefix, user_agent, max_maps, cut)
+    if shard is not None:
+        maps = _sharded(maps, shard, seen)
+    out["maps"].extend(merge_entries(pipeline.entries(maps)))
+    if pipeline.missing:
+        out["missing"] = pipeline.missing_maps()
+    if shard is not None:
+        out["shard"] = shard_block(shard, seen)
+    snapshots = snapshot_store()
+    if snapshots is not None:
+        snapshots.record_campaign(author, prefix, seen if shard is not None else pipeline.maps)
+    if times_core.AUTHOR_TIME_SOURCE == "verify":
+        for line in verify_author_times(out["maps"], user_agent, workers):
+            print(line, file=sys.stderr)
+    return out
+
+
+def merge_shards(docs: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """Combine `--shard` outputs into the document a single unsharded run writes.
+
+    Maps are put back in discovery order and the earliest shard start becomes the one
+    `generated_at`. Returns (document, []) or (None, problems) when shards are missing
+    or duplicated, disagree on the campaign or its map list, or a map is in the wrong
+    shard, in two shards, or in none.
+    """
+    problems: List[str] = []
+    if not docs:
+        return None, ["no shard outputs given"]
+    blocks = [d.get("shard") for d in docs]
+    if not all(isinstance(b, dict) for b in blocks):
+        return None, ["not every input is a --shard output"]
+    first = docs[0]
+    count = blocks[0]["count"]
+    order = blocks[0]["order"]
+    for d, b in zip(docs, blocks):
+        if (d.get("author"), d.get("prefix")) != (first.get("author"), first.get("prefix")):
+            problems.append(f"shard {b['index']} is for {d.get('author')}/{d.get('prefix')}, not {first.get('author')}/{first.get('prefix')}")
+        if b["count"] != count:
+            problems.append(f"shard {b['index']}/{b['count']} mixed with shards of {count}")
+        elif b["order"] != order:
+            problems.append(f"shard {b['index']} discovered a different map list; rerun the shards")
+    indices = [b["index"] for b in blocks]
+    for i in sorted(set(indices)):
+        if indices.count(i) > 1:
+            problems.append(f"shard {i}/{count} given {indices.count(i)} times")
+    absent = [i for i in range(1, count + 1) if i not in indices]
+    if absent:
+        problems.append("missing shard(s): " + ", ".join(f"{i}/{count}" for i in absent))
+    if problems:
+        return None, problems
+
+    position = {uid: n for n, uid in enumerate(order)}
+    found: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    gaps: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    for d, b in zip(docs, blocks):
+        for kind, items in (("map", d.get("maps") or []), ("missing", d.get("missing") or [])):
+            for item in items:
+                uid = item.get("uid")
+                if uid not in position:
+                    problems.append(f"{uid}: in shard {b['index']} but not in the discovered map list")
+                elif uid in found or uid in gaps:
+                    problems.append(f"{uid}: in more than one shard")
+                elif shard_of(uid, count) != b["index"]:
+                    problems.append(f"{uid}: belongs to shard {shard_of(uid, count)}, found in shard {b['index']}")
+                else:
+                    (found if kind == "map" else gaps)[uid] = (b["index"], item)
+    for uid in order:
+        if uid not in found and uid not in gaps:
+            problems.append(f"{uid}: in no shard output (shard {shard_of(uid, count)} incomplete)")
+    if problems:
+        return None, problems
+
+    out: Dict[str, Any] = {
+        "author": first.get("author"),
+        "prefix": first.get("prefix"),
+        "generated_at": min(d.get("generated_at") or "" for d in docs),
+        "maps": [found[uid][1] for uid in order if uid in found],
+    }
+    if gaps:
+        out["missing"] = [gaps[uid][1] for uid in order if uid in gaps]
+    truncated = [d["truncated"] for d in docs if d.get("truncated")]
+    if truncated:
+        out["truncated"] = truncated[0]
+    return out, []
+
+
+def cmd_merge(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="generate_times.py merge",
+        description="Combine the outputs of `--shard i/N` runs into one document, in discovery order",
+    )
+    ap.add_argument("shards", nargs="+", help="Shard output JSON files, one per shard")
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--bundle", default=None, help="Also write the plugin's medal bundle for the merged campaign here")
+    args = ap.parse_args(argv)
+    docs = []
+    for path in args.shards:
+        with open(path, "r", encoding="utf-8") as f:
+            docs.append(json.load(f))
+    out, problems = merge_shards(docs)
+    if out is None:
+        for line in problems:
+            print(f"merge: {line}", file=sys.stderr)
+        return 1
+    write_document(out, args.out)
+    bundled = write_bundle(out, args.bundle) if args.bundle else True
+    print(f"Merge: {len(docs)} shard(s), {len(out['maps'])} map(s)", file=sys.stderr)
+    print_missing(out)
+    return 0 if bundled else 1
+
+
+def load_jobs(path: str) -> List[Dict[str, Any]]:
+    """Read a batch job file: a JSON list (or {"jobs": [...]}) of {author, prefix, out[, max_maps]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    jobs = doc.get("jobs") if isinstance(doc, dict) else doc
+    if not isinstance(jobs, list):
+        raise ValueError(f"{path}: expected a list of jobs")
+    for i, job in enumerate(jobs):
+        if not isinstance(job, dict) or not all(job.get(k) for k in ("author", "prefix", "out")):
+            raise ValueError(f"{path}: job {i} needs author, prefix and out")
+    return jobs
+
+
+def cmd_batch(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="generate_times.py batch",
+        description="Run many (author, prefix, out) jobs in one process with a shared pool, limiter and leaderboard cache",
+    )
+    ap.add_argument("jobs_file")
+    ap.add_argument("--jobs", type=int, default=2, help="Jobs run concurrently")
+    ap.add_argument("--max-maps", type=int, default=0, help="Default for jobs without max_maps (0 = no limit)")
+    ap.add_argument("--summary", default="-", help="Where to write the combined JSON summary")
+    ap.add_argument("--snapshots", default=None, help="Log raw leaderboards to this SQLite file for `recompute`")
+    add_leaderboard_args(ap)
+    add_network_args(ap)
+    args = ap.parse_args(argv)
+    check_leaderboard_args(ap, args)
+
+    jobs = load_jobs(args.jobs_file)
+    job_workers = max(1, args.jobs)
+    configure_network(args, concurrency=job_workers * max(1, args.workers))
+    configure_snapshots(args.snapshots)
+    configure_leaderboard(args.depth, args.time_a_n)
+    configure_author_time(args.author_time)
+    configure_sparse_retries(args.sparse_retries, args.sparse_retry_delay)
+    configure_hedging(args.hedge_after)
+    memo = configure_shared_memo(True)
+
+    def run(job: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.monotonic()
+        result: Dict[str, Any] = {"author": job["author"], "prefix": job["prefix"], "out": job["out"]}
         try:
-            if val is not None:
-                return int(val)
-        except (TypeError, ValueError):
-            return None
-        # Missing value; back off and retry
-        if attempt < 3:
-            time.sleep(min(2.0, 0.5 * (2 ** attempt)))
-    return None
-
-
-def compute_time_a(times_ms: List[int], c: float = 1.1, n: int = 50) -> Optional[float]:
-    if len(times_ms) < n:
-        return None
-    top = times_ms[:n]
-    num = 0.0
-    den = 0.0
-    for i in range(1, n + 1):
-        w = c ** (21 - i)
-        num += w * top[i - 1]
-        den += w
-    if den == 0:
-        return None
-    return num / den
-
-
-def compute_time_b(t_at: int, t_wr: int, f: float = 0.5) -> float:
-    diff = t_at - t_wr
-    return t_at - f * diff
-
-
-def compute_harder_time(t_at: int, t_wr: int, factor: Optional[float] = 0.25) -> int:
-    """1/4 of the way from AuthorTime toward WR by default. Always at least 1 ms faster than AT."""
-    if t_at is None or t_wr is None:
-        return int(t_at or 0)
-    f = 0.25 if factor is None else factor
-    try:
-        offs = int((int(t_at) - int(t_wr)) * f)
-    except Exception:
-        offs = 0
-    return int(t_at) - max(offs, 1)
-
-
-def compute_from_times(t_at: int, times: List[int]) -> Dict[str, Any]:
-    """Compute Time_A/Time_B/Medal from author time and a list of top times (ms)."""
-    times = [int(t) for t in times if isinstance(t, (int, float))]
-    times.sort()
-    records_count = len(times)
-    t_wr = times[0] if records_count > 0 else t_at
-    time_b = compute_time_b(int(t_at or 0), int(t_wr or 0), 0.5)
-    time_a_val = compute_time_a(times, 1.1, 50) if records_count >= 50 else None
-    harder = compute_harder_time(int(t_at or 0), int(t_wr or 0), 0.125)
-    if time_a_val is None:
-        medal = time_b
-        method = "Time_B"
-    else:
-        medal = time_a_val
-        method = "Time_A"
-    return {
-        "authorTime_ms": int(t_at or 0),
-        "wrTime_ms": int(t_wr or 0),
-        "recordsCount": records_count,
-        "timeA_ms": int(round(time_a_val)) if time_a_val is not None else None,
-        "timeB_ms": int(round(time_b)),
-        "harderTime_ms": int(harder),
-        "medalTime_ms": int(round(medal)),
-        "method": method,
+            out = generate_document(
+                job["author"], job["prefix"], args.user_agent, int(job.get("max_maps") or args.max_maps), args.workers
+            )
+            write_document(out, job["out"])
+            result["maps"] = len(out["maps"])
+            result["missing"] = len(out.get("missing") or [])
+            result["ok"] = not result["missing"]
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        result["elapsed_s"] = round(time.monotonic() - started, 3)
+        if "error" in result:
+            note = f"failed: {result['error']}"
+        else:
+            note = f"{result['maps']} map(s)" + (f", {result['missing']} missing" if result["missing"] else "")
+        print(f"[batch] {job['author']}/{job['prefix']}: {note}", file=sys.stderr)
+        return result
+
+    started = time.monotonic()
+    results = list(ordered_map(run, jobs, job_workers))
+    summary = {
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "elapsed_s": round(time.monotonic() - started, 3),
+        "jobs": results,
+        "ok": sum(1 for r in results if r["ok"]),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "maps": sum(r.get("maps", 0) for r in results),
+        "missing": sum(r.get("missing", 0) for r in results),
+        "shared_cache": {"hits": memo.hits, "misses": memo.misses},
+        "http": pool_stats(),
     }
+    write_document(summary, args.summary)
+    write_metrics(args.metrics, args.metrics_prom)
+    print_http_stats()
+    configure_shared_memo(False)
+    return 0 if summary["failed"] == 0 else 1
+
+
+def recompute_document(
+    store: SnapshotStore,
+    author: str,
+    prefix: str,
+    engine: MedalEngine,
+    as_of: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Rebuild a campaign's output from stored snapshots with `engine`'s formula, offline."""
+    latest = store.latest(as_of)
+    listed = [(uid, meta) for uid, meta in store.campaign(author, prefix) if uid in latest]
+    results = engine.evaluate_batch((latest[uid][1], latest[uid][2]) for uid, _ in listed)
+    out: Dict[str, Any] = {
+        "author": author,
+        "prefix": prefix,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "maps": [],
+    }
+    # The depth the snapshots were taken at is not stored, so these entries never match a run's settings
+    settings = dict(leaderboard_settings(engine), depth=None)
+    for (uid, meta), medals in zip(listed, results):
+        medals.leaderboard_hash = leaderboard_hash(engine.clean_times(latest[uid][2]))
+        medals.author_time_source = "snapshot"
+        out["maps"].append(build_entry(MapRecord.from_tmx(dict(meta, MapUid=uid)), medals, settings))
+    return out
+
 
+def cmd_recompute(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="generate_times.py recompute",
+        description="Regenerate medal JSON from a --snapshots database with different formula parameters, without network access",
+    )
+    ap.add_argument("snapshots")
+    ap.add_argument("--author", default=None, help="Campaign author (default: the only campaign in the database)")
+    ap.add_argument("--prefix", default=None)
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--c", type=float, default=1.1, help="Time_A weight base")
+    ap.add_argument("--n", type=int, default=50, help="Records Time_A uses; fewer records fall back to Time_B")
+    ap.add_argument("--time-b-factor", type=float, default=0.5)
+    ap.add_argument("--harder-factor", type=float, default=0.125)
+    ap.add_argument("--as-of", default=None, help="Use the newest snapshots taken at or before this ISO time (UTC)")
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.snapshots):
+        ap.error(f"{args.snapshots}: no such file")
 
-def compute_for_map(m: Dict[str, Any], replays: List[Dict[str, Any]]) -> Dict[str, Any]:
+    store = SnapshotStore(args.snapshots)
     try:
-        # Author time can be under AuthorTime (older) or Medals.Author (v2 maps)
-        medals = m.get("Medals") or {}
-        at_val = m.get("AuthorTime") if m.get("AuthorTime") is not None else medals.get("Author")
-        try:
-            t_at = int(at_val if at_val is not None else 0)
-        except (TypeError, ValueError):
-            t_at = 0
-        
-        # Filter for Position 1-50 and extract ReplayTime
-        top_20_replays: List[Dict[str, Any]] = []
-        for r in replays:
-            pos = r.get("Position")
-            if pos is None:
-                continue
-            try:
-                pos_i = int(pos)
-            except (TypeError, ValueError):
-                continue
-            # Use positions 1-50 (aligned with TMIO top length)
-            if 1 <= pos_i <= 50:
-                top_20_replays.append(r)
-        times: List[int] = []
-        for r in top_20_replays:
-            rt = r.get("ReplayTime")
-            if rt is None:
-                continue
+        if args.author is None or args.prefix is None:
+            found = [c for c in store.campaigns() if args.author in (None, c[0]) and args.prefix in (None, c[1])]
+            if len(found) != 1:
+                listing = ", ".join(f"{a}/{p}" for a, p in found) or "none"
+                ap.error(f"pick a campaign with --author/--prefix (found: {listing})")
+            args.author, args.prefix = found[0]
+        as_of = None
+        if args.as_of:
             try:
-                times.append(int(rt))
-            except (TypeError, ValueError):
-                continue
-        # Sort ascending by time (should already be sorted by Position, but ensure)
-        times.sort()
-        records_count = len(times)
-        if records_count > 0:
-            t_wr = times[0]
-        else:
-            # No replays with Position 0-19; use AuthorTime as fallback
-            t_wr = t_at
-        time_b = compute_time_b(t_at, t_wr, 0.5)
-        if records_count >= 50:
-            time_a_val = compute_time_a(times, 1.1, 50)
-        else:
-            time_a_val = None
-        harder = compute_harder_time(int(t_at), int(t_wr), 0.125)
-        if time_a_val is None:
-            medal = time_b
-            method = "Time_B"
-        else:
-            medal = time_a_val
-            method = "Time_A"
-        return {
-            "authorTime_ms": int(t_at),
-            "wrTime_ms": int(t_wr),
-            "recordsCount": records_count,
-            "timeA_ms": int(round(time_a_val)) if time_a_val is not None else None,
-            "timeB_ms": int(round(time_b)),
-            "harderTime_ms": int(harder),
-            "medalTime_ms": int(round(medal)),
-            "method": method,
-        }
-    except Exception as e:
-        return {
-            "authorTime_ms": 0,
-            "wrTime_ms": 0,
-            "recordsCount": 0,
-            "timeA_ms": None,
-            "timeB_ms": 0.0,
-            "medalTime_ms": 0.0,
-            "method": f"Error: {str(e)}",
-        }
+                when = datetime.fromisoformat(args.as_of[:-1] + "+00:00" if args.as_of.endswith("Z") else args.as_of)
+            except ValueError:
+                ap.error(f"--as-of: not an ISO time: {args.as_of!r}")
+            # Snapshot times are UTC epoch seconds; a time without an offset is taken as UTC
+            as_of = (when if when.tzinfo else when.replace(tzinfo=timezone.utc)).timestamp()
+        engine = MedalEngine(args.c, args.n, args.time_b_factor, args.harder_factor)
+        started = time.perf_counter()
+        out = recompute_document(store, args.author, args.prefix, engine, as_of)
+        print(f"Recompute: {len(out['maps'])} map(s) in {time.perf_counter() - started:.3f}s", file=sys.stderr)
+    finally:
+        store.close()
+    write_document(out, args.out)
+    return 0
 
 
-def main(argv: List[str]) -> int:
-    ap = argparse.ArgumentParser()
+def activity_key(times: List[int]) -> Tuple[Optional[int], Optional[int]]:
+    """The leaderboard features the watcher treats as activity: WR and the 50th time."""
+    return (times[0] if times else None, times[49] if len(times) >= 50 else None)
+
+
+class LeaderboardWatcher:
+    """Polls each map's TMIO leaderboard on its own schedule and recomputes its medals.
+
+    A map whose WR or 50th time moved is polled again after `min_interval`; every quiet
+    poll doubles its interval up to `max_interval`. Request pacing (the global budget)
+    is left to the per-host limiter in `http_get`. `on_change` receives entries whose
+    medal times changed.
+    """
+
+    def __init__(
+        self,
+        entries: List[Dict[str, Any]],
+        user_agent: str,
+        on_change: Callable[[Dict[str, Any]], None],
+        min_interval: float = 300.0,
+        max_interval: float = 6 * 3600.0,
+    ):
+        self.entries = {e["uid"]: e for e in entries if e.get("uid")}
+        self.user_agent = user_agent
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.activity: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        self.interval = {uid: min_interval for uid in self.entries}
+        now = time.monotonic()
+        self._due: List[Tuple[float, str]] = [(now, uid) for uid in self.entries]
+        heapq.heapify(self._due)
+        self.polls = 0
+        self.changes = 0
+
+    def poll(self, uid: str) -> Optional[bool]:
+        """Refetch one leaderboard; returns whether it showed activity, or None when there
+        is nothing to compare yet (first poll) or the fetch failed."""
+        entry = self.entries[uid]
+        self.polls += 1
+        try:
+            board = Leaderboard.fetch(uid, self.user_agent, fresh=True)
+        except FetchError:
+            return None
+        times = board.times
+        if not times:
+            return None
+        key = activity_key(times)
+        active = self.activity[uid] != key if uid in self.activity else None
+        self.activity[uid] = key
+        medals = medal_engine().evaluate(int(entry.get("authorTime_ms") or 0), times)
+        medals.leaderboard_hash = board.hash
+        medals.author_time_source = (entry.get("source") or {}).get("author_time")
+        hook = snapshot_hook(uid)
+        if hook is not None:
+            hook(medals.author_time, times)
+        fresh = build_entry(MapRecord.from_entry(entry), medals)
+        old_comp, new_comp = entry.get("computed") or {}, fresh["computed"]
+        if any(old_comp.get(k) != new_comp.get(k) for k in ("harderTime_ms", "medalTime_ms")):
+            self.entries[uid] = fresh
+            self.changes += 1
+            self.on_change(fresh)
+        return active
+
+    def run(self, max_polls: Optional[int] = None, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        while self._due and not stop.is_set():
+            if max_polls is not None and self.polls >= max_polls:
+                return
+            due, uid = self._due[0]
+            delay = due - time.monotonic()
+            if delay > 0 and stop.wait(delay):
+                return
+            heapq.heappop(self._due)
+            active = self.poll(uid)
+            if active:
+                self.interval[uid] = self.min_interval
+            elif active is not None:
+                self.interval[uid] = min(self.max_interval, self.interval[uid] * 2)
+            heapq.heappush(self._due, (time.monotonic() + self.interval[uid], uid))
+
+
+def cmd_watch(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="generate_times.py watch",
+        description="Keep a campaign's medal times fresh: poll leaderboards by activity and rewrite/publish only on medal changes",
+    )
     ap.add_argument("--author", required=True)
     ap.add_argument("--prefix", required=True)
-    ap.add_argument("--out", default="-")
-    ap.add_argument("--user-agent", default="TMX-Times-Generator/1.0")
-    ap.add_argument("--max-maps", type=int, default=100)
+    ap.add_argument("--out", required=True, help="Output JSON kept up to date (loaded at start if it exists)")
+    ap.add_argument("--max-maps", type=int, default=0, help="Stop searching once this many maps were found (0 = no limit)")
+    ap.add_argument("--rpm", type=float, default=30.0, help="Leaderboard requests per minute, across all maps")
+    ap.add_argument("--min-interval", type=float, default=300.0, help="Poll interval (s) for maps with recent WR/50th-time changes")
+    ap.add_argument("--max-interval", type=float, default=6 * 3600.0, help="Poll interval cap (s) for dormant maps")
+    ap.add_argument("--max-cycles", type=int, default=None, help="Stop after this many leaderboard polls (for testing)")
+    ap.add_argument("--publish", default=None, help="Firebase node URL to publish changed entries to")
+    ap.add_argument("--auth-token", default=os.environ.get("FIREBASE_AUTH_TOKEN"))
+    ap.add_argument("--snapshots", default=None, help="Log every polled leaderboard to this SQLite file")
+    add_leaderboard_args(ap)
+    add_network_args(ap)
     args = ap.parse_args(argv)
+    check_leaderboard_args(ap, args)
+    if args.rpm <= 0:
+        ap.error("--rpm must be positive")
+
+    configure_network(args)
+    configure_snapshots(args.snapshots)
+    configure_leaderboard(args.depth, args.time_a_n)
+    configure_author_time(args.author_time)
+    configure_sparse_retries(args.sparse_retries, args.sparse_retry_delay)
+    configure_hedging(args.hedge_after)
+
+    if os.path.exists(args.out):
+        with open(args.out, "r", encoding="utf-8") as f:
+            out = json.load(f)
+        print(f"Watch: loaded {len(out.get('maps') or [])} map(s) from {args.out}", file=sys.stderr)
+    else:
+        out = generate_document(args.author, args.prefix, args.user_agent, args.max_maps, args.workers)
+        write_document(out, args.out)
+        print(f"Watch: initial run wrote {len(out['maps'])} map(s) to {args.out}", file=sys.stderr)
+        print_missing(out)
+
+    remote: Dict[str, Any] = {}
+    if args.publish:
+        # Read the node once; afterwards `remote` tracks what this process has written
+        remote.update(fetch_node(args.publish, args.user_agent, args.auth_token))
+        res = publish_entries(args.publish, out["maps"], args.user_agent, args.auth_token, remote=remote)
+        publish_bundle(args.publish, bundle_document(published_document(out, remote)), args.user_agent, args.auth_token)
+        print(f"Watch: published {res['changed']} initial change(s), held back {res['held']}", file=sys.stderr)
+
+    # The budget covers the polling loop; the initial full run above used --rate
+    configure_limiter(args.rpm / 60.0, 1.0, args.retries)
+    position = {e["uid"]: i for i, e in enumerate(out["maps"])}
+
+    def on_change(entry: Dict[str, Any]) -> None:
+        old = out["maps"][position[entry["uid"]]]
+        out["maps"][position[entry["uid"]]] = entry
+        out["generated_at"] = datetime.utcnow().isoformat() + "Z"
+        write_document(out, args.out)
+        moved = ", ".join(
+            f"{k} {(old.get('computed') or {}).get(k)} -> {entry['computed'][k]}" for k in ("harderTime_ms", "medalTime_ms")
+        )
+        print(f"  ~ {entry.get('name')} ({entry['uid']}): {moved}", file=sys.stderr)
+        if args.publish:
+            publish_entries(args.publish, [entry], args.user_agent, args.auth_token, remote=remote)
+            # The plugin skips per-map fetches while its bundle is current, so keep it in step
+            publish_bundle(args.publish, bundle_document(published_document(out, remote)), args.user_agent, args.auth_token)
+
+    watcher = LeaderboardWatcher(out["maps"], args.user_agent, on_change, args.min_interval, args.max_interval)
+    try:
+        watcher.run(args.max_cycles)
+    except KeyboardInterrupt:
+        pass
+    print(f"Watch: {watcher.polls} poll(s), {watcher.changes} medal change(s)", file=sys.stderr)
+    write_metrics(args.metrics, args.metrics_prom)
+    print_http_stats()
+    return 0
 
-    maps = fetch_maps(args.author, args.prefix, args.user_agent, args.max_maps)
 
-    out = {
-        "author": args.author,
-        "prefix": args.prefix,
-        "generated_at": datetime.utcnow().isoformat() + "Z",
-        "maps": [],
-    }
+COMMANDS: Dict[str, Callable[[List[str]], int]] = {
+    "finalize": cmd_finalize,
+    "batch": cmd_batch,
+    "recompute": cmd_recompute,
+    "watch": cmd_watch,
+    "merge": cmd_merge,
+}
 
-    for m in maps:
-        # Force TMIO-only: require UID and compute exclusively from trackmania.io
-        uid = m.get("MapUid") or m.get("TrackUID")
-        if not isinstance(uid, str) or not uid:
-            # Skip maps without a UID when forcing TMIO
-            continue
 
-        t_at_tmio = fetch_tmio_author_time(uid, args.user_agent) or 0
-        tops = fetch_tmio_leaderboard(uid, args.user_agent, 50)
-        times: List[int] = []
-        for e in tops:
-            t = e.get("time") if isinstance(e, dict) else None
-            if t is None:
-                continue
-            try:
-                times.append(int(t))
-            except (TypeError, ValueError):
-                continue
-        comp = compute_from_times(int(t_at_tmio or 0), times)
-        if comp["recordsCount"] < 20 or comp["authorTime_ms"] == 0:
-            time.sleep(1.0)
-            t_at_tmio = fetch_tmio_author_time(uid, args.user_agent) or 0
-            tops = fetch_tmio_leaderboard(uid, args.user_agent, 50)
-            times = []
-            for e in tops:
-                t = e.get("time") if isinstance(e, dict) else None
-                if t is None:
+def main(argv: List[str]) -> int:
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--author", required=True)
+    ap.add_argument("--prefix", required=True)
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--max-maps", type=int, default=0, help="Stop searching once this many maps were found (0 = no limit)")
+    add_network_args(ap)
+    ap.add_argument("--update-from", default=None, help="Previous output JSON; reuse entries whose leaderboard is unchanged")
+    ap.add_argument("--publish", default=None, help="Firebase node URL (e.g. .../ubu10/) to publish changed entries to")
+    ap.add_argument("--auth-token", default=os.environ.get("FIREBASE_AUTH_TOKEN"), help="Firebase auth token (default: $FIREBASE_AUTH_TOKEN)")
+    ap.add_argument("--publish-chunk", type=int, default=100, help="Max entries per PATCH request when publishing")
+    ap.add_argument("--stream", default=None, help="Write each entry to this NDJSON file as soon as it is computed")
+    ap.add_argument("--resume", action="store_true", help="With --stream, skip maps already in the stream's journal")
+    ap.add_argument("--timings", action="store_true", help="Add a per-map timing breakdown to each entry")
+    ap.add_argument("--slim", default=None, help="Also write the slim per-UID projection the plugin reads to this file")
+    ap.add_argument("--gzip", action="store_true", help="With --slim, also write a gzip copy next to it")
+    ap.add_argument("--audit", default=None, help="Write the provenance fields left out of --slim to this file")
+    ap.add_argument("--bundle", default=None, help="Write the versioned, checksummed medal bundle the plugin preloads to this file")
+    ap.add_argument("--snapshots", default=None, help="Log raw leaderboards to this SQLite file for `recompute`")
+    ap.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="I/N",
+        help="Compute only the maps whose UID hashes to shard I of N; combine the outputs with `merge`",
+    )
+    add_leaderboard_args(ap)
+    args = ap.parse_args(argv)
+    check_leaderboard_args(ap, args)
+    if args.resume and not args.stream:
+        ap.error("--resume requires --stream")
+    if args.gzip and not args.slim:
+        ap.error("--gzip requires --slim")
+
+    configure_map_timings(args.timings)
+    previous = load_previous(args.update_from) if args.update_from else None
+    if previous is not None and args.shard is not None:
+        # Other shards' maps are not "no longer listed"
+        previous = {uid: e for uid, e in previous.items() if shard_of(uid, args.shard[1]) == args.shard[0]}
+    configure_network(args)
+    configure_snapshots(args.snapshots)
+    configure_leaderboard(args.depth, args.time_a_n)
+    configure_author_time(args.author_time)
+    configure_sparse_retries(args.sparse_retries, args.sparse_retry_delay)
+    configure_hedging(args.hedge_after)
+
+    # Force TMIO-only: maps without a UID are skipped
+    if args.stream:
+        header = {
+            "author": args.author,
+            "prefix": args.prefix,
+            "generated_at": datetime.utcnow().isoformat() + "Z",
+        }
+        writer = StreamWriter(args.stream, header, resume=args.resume)
+        already = set(writer.done)
+        maps: List[MapRecord] = []
+        order: Dict[str, int] = {}
+        cut: List[int] = []
+
+        def todo() -> Iterator[Dict[str, Any]]:
+            for i, m in enumerate(fetch_maps(args.author, args.prefix, args.user_agent, args.max_maps, cut.append)):
+                rec = MapRecord.from_tmx(m)
+                if rec is None:
                     continue
-                try:
-                    times.append(int(t))
-                except (TypeError, ValueError):
+                maps.append(rec)
+                order[rec.uid] = i
+                if args.shard is not None and shard_of(rec.uid, args.shard[1]) != args.shard[0]:
                     continue
-            comp2 = compute_from_times(int(t_at_tmio or 0), times)
-            if (comp2["recordsCount"] > comp["recordsCount"]) or (comp["authorTime_ms"] == 0 and comp2["authorTime_ms"] > 0):
-                comp = comp2
+                if rec.uid not in already:
+                    yield m
 
-        track_id_val = m.get("MapId") or m.get("TrackID") or m.get("TrackId")
+        pipeline = Pipeline(args.user_agent, args.workers, previous)
         try:
-            track_id = int(track_id_val)
-        except (TypeError, ValueError):
-            track_id = None
-
-        entry = {
-            "trackId": track_id,
-            "uid": uid,
-            "name": m.get("Name") or m.get("TrackName"),
-            "author": m.get("Username") or (m.get("Uploader") or {}).get("Name"),
-            "authorTime_ms": comp["authorTime_ms"],
-            "wrTime_ms": comp["wrTime_ms"],
-            "recordsCount": comp["recordsCount"],
-            "computed": {
-                "timeA_ms": comp["timeA_ms"],
-                "timeB_ms": comp["timeB_ms"],
-                "harderTime_ms": comp["harderTime_ms"],
-                "medalTime_ms": comp["medalTime_ms"],
-                "method": comp["method"],
-            },
-            "source": {
-                "tmx_map_url": f"https://trackmania.exchange/maps/{track_id}" if track_id is not None else None,
-                "tmio_leaderboard_url": f"https://trackmania.io/api/leaderboard/map/{uid}?offset=0&length=50",
-                "tmio_map_url": f"https://trackmania.io/api/map/{uid}",
-                "api_search": "https://trackmania.exchange/api/maps",
-                "source_preference": "tmio",
-            },
-        }
-        out["maps"].append(entry)
-        time.sleep(0.15)
-
-    if args.out == "-":
-        json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
-        sys.stdout.write("\n")
+            for result in pipeline.results(todo()):
+                writer.write(order.get(result.uid, len(order)), result.to_entry())
+        finally:
+            writer.close()
+        if already:
+            print(f"Resume: {sum(1 for uid in order if uid in already)} map(s) already in {args.stream}", file=sys.stderr)
+        snapshots = snapshot_store()
+        if snapshots is not None:
+            snapshots.record_campaign(args.author, args.prefix, maps)
+        out = document_from_stream(args.stream)
+        if pipeline.missing:
+            out["missing"] = pipeline.missing_maps()
+        if cut:
+            out["truncated"] = cut[0]
+        if args.shard is not None:
+            out["shard"] = shard_block(args.shard, maps)
+        if times_core.AUTHOR_TIME_SOURCE == "verify":
+            for line in verify_author_times(out["maps"], args.user_agent, args.workers):
+                print(line, file=sys.stderr)
     else:
-        with open(args.out, "w", encoding="utf-8") as f:
-            json.dump(out, f, ensure_ascii=False, indent=2)
-    return 0
+        out = generate_document(args.author, args.prefix, args.user_agent, args.max_maps, args.workers, previous, args.shard)
+    if previous is not None:
+        for line in diff_summary(previous, out["maps"]):
+            print(line, file=sys.stderr)
+
+    write_document(out, args.out)
+    if args.slim:
+        for path in write_slim(slim_document(out), args.slim, args.gzip):
+            print(f"Slim: wrote {path} ({os.path.getsize(path)} bytes)", file=sys.stderr)
+    if args.audit:
+        write_document(audit_document(out), args.audit)
+    bundled = write_bundle(out, args.bundle) if args.bundle else True
+    if args.publish:
+        remote = fetch_node(args.publish, args.user_agent, args.auth_token)
+        res = publish_entries(args.publish, out["maps"], args.user_agent, args.auth_token, args.publish_chunk, remote)
+        print(
+            f"Publish: {res['changed']} of {res['local']} entr(ies) changed "
+            f"({res['remote']} remote), {res['held']} held back, {res['writes']} write(s)",
+            file=sys.stderr,
+        )
+        if args.shard is None:
+            # Concurrent shards would race on the bundle; use `merge --bundle` instead.
+            # Built from the whole node, so maps missing from this run keep their published entries.
+            bundle = bundle_document(published_document(out, remote))
+            updated = publish_bundle(args.publish, bundle, args.user_agent, args.auth_token)
+            print(f"Publish: bundle {bundle['version']} " + ("written" if updated else "already current"), file=sys.stderr)
+    write_metrics(args.metrics, args.metrics_prom)
+    print_http_stats()
+    print_missing(out)
+    return 1 if out.get("missing") or not bundled else 0
 
 
 if __name__ == "__main__":
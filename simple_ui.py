@@ -1,108 +1,111 @@
 import json
+import os
+import queue
 import threading
 from datetime import datetime
-from tkinter import Tk, Label, Entry, Button, Text, END, DISABLED, NORMAL, messagebox, filedialog
+from tkinter import Tk, Label, Entry, Button, StringVar, DISABLED, NORMAL, messagebox, filedialog
+from tkinter import ttk
 
-import generate_times as gt
+import times_core
+import times_net
+import times_output
 
 DEFAULT_UA = "Medal-Times-Generator/1.0"
+DEFAULT_WORKERS = 4
+POLL_MS = 100
 
+TABLE_COLUMNS = [
+    ("idx", "#", 40),
+    ("name", "Map", 220),
+    ("at", "Author", 80),
+    ("wr", "WR", 80),
+    ("records", "Recs", 50),
+    ("harder", "Harder", 80),
+    ("hardest", "Hardest", 80),
+    ("method", "Method", 70),
+]
 
-def compute_and_render(author: str, prefix: str, ua: str, text_widget: Text, calculate_btn: Button):
+
+def format_ms(ms) -> str:
+    if not isinstance(ms, int) or ms <= 0:
+        return "-"
+    minutes, rest = divmod(ms, 60000)
+    return f"{minutes}:{rest // 1000:02d}.{rest % 1000:03d}"
+
+
+def row_values(n: int, entry) -> tuple:
+    comp = entry.get("computed") or {}
+    return (
+        n,
+        entry.get("name") or entry.get("uid"),
+        format_ms(entry.get("authorTime_ms")),
+        format_ms(entry.get("wrTime_ms")),
+        entry.get("recordsCount"),
+        format_ms(comp.get("harderTime_ms")),
+        format_ms(comp.get("medalTime_ms")),
+        comp.get("method") or "",
+    )
+
+
+def compute_worker(
+    author: str,
+    prefix: str,
+    ua: str,
+    workers: int,
+    max_maps,
+    progress: queue.Queue,
+    cancel: threading.Event,
+):
+    """Background thread: fetch and compute, reporting only through `progress` (never touching Tk).
+
+    Maps are computed while the search is still paging; each discovered map is reported
+    with a "found" message so the progress bar can grow with it.
+    """
     try:
-        text_widget.config(state=NORMAL)
-        text_widget.delete(1.0, END)
-        text_widget.insert(END, f"Fetching maps for author='{author}', prefix='{prefix}'...\n")
-        maps = gt.fetch_maps(author, prefix, ua, 1000)
-        text_widget.insert(END, f"Found {len(maps)} map(s). Fetching leaderboards...\n")
+        progress.put(("status", f"Searching maps for author='{author}', prefix='{prefix}'..."))
+        skipped = [0]
+
+        def discovered():
+            found = 0
+            for m in times_net.fetch_maps(author, prefix, ua, max_maps):
+                if times_core.MapRecord.from_tmx(m) is None:
+                    skipped[0] += 1
+                    continue
+                found += 1
+                progress.put(("found", found))
+                yield m
+
         out = {
             "author": author,
             "prefix": prefix,
             "generated_at": datetime.utcnow().isoformat() + "Z",
             "maps": [],
         }
-        for idx, m in enumerate(maps, start=1):
-            track_id_val = m.get("MapId") or m.get("TrackID") or m.get("TrackId")
-            try:
-                track_id = int(track_id_val)
-            except (TypeError, ValueError):
-                text_widget.insert(END, f"[{idx}/{len(maps)}] Skipping map with invalid ID: {track_id_val}\n")
-                text_widget.see(END)
-                text_widget.update()
+        rows = {}
+        pipeline = times_core.Pipeline(ua, workers, cancel=cancel)
+        for result in pipeline.results(discovered()):
+            entry = result.to_entry()
+            n = rows.get(result.uid)
+            if n is not None:
+                # Deferred retry of a sparse map: replaces its earlier entry
+                out["maps"][n - 1] = entry
+                progress.put(("retried", n, entry))
                 continue
-            uid = m.get("MapUid") or m.get("TrackUID")
-            map_name = m.get("Name") or m.get("TrackName")
-            text_widget.insert(END, f"[{idx}/{len(maps)}] Map {track_id} - {map_name} (uid={uid})\n")
-            text_widget.see(END)
-            text_widget.update()
-
-            if not (isinstance(uid, str) and uid):
-                text_widget.insert(END, f"[{idx}/{len(maps)}] Skipping map without UID (TMIO-only).\n")
-                text_widget.see(END)
-                text_widget.update()
-                continue
-            # TMIO-only computation
-            t_at_tmio = gt.fetch_tmio_author_time(uid, ua) or 0
-            tops = gt.fetch_tmio_leaderboard(uid, ua, 50)
-            times = []
-            for e in tops:
-                t = e.get("time") if isinstance(e, dict) else None
-                if t is None:
-                    continue
-                try:
-                    times.append(int(t))
-                except (TypeError, ValueError):
-                    continue
-            comp = gt.compute_from_times(int(t_at_tmio or 0), times)
-            used_tmio = True
-
-            entry = {
-                "trackId": track_id,
-                "uid": uid,
-                "name": map_name,
-                "author": m.get("Username") or (m.get("Uploader") or {}).get("Name"),
-                "authorTime_ms": comp["authorTime_ms"],
-                "wrTime_ms": comp["wrTime_ms"],
-                "recordsCount": comp["recordsCount"],
-                "computed": {
-                    "timeA_ms": comp["timeA_ms"],
-                    "timeB_ms": comp["timeB_ms"],
-                    "harderTime_ms": comp["harderTime_ms"],
-                    "medalTime_ms": comp["medalTime_ms"],
-                    "method": comp["method"],
-                },
-                "source": {
-                    "tmx_map_url": f"https://trackmania.exchange/maps/{track_id}",
-                    "tmio_leaderboard_url": f"https://trackmania.io/api/leaderboard/map/{uid}?offset=0&length=50" if uid else None,
-                    "tmio_map_url": f"https://trackmania.io/api/map/{uid}" if uid else None,
-                    "api_search": "https://trackmania.exchange/api/maps",
-                    "api_replays": "https://trackmania.exchange/api/replays",
-                    "source_preference": "tmio" if used_tmio else "tmx",
-                },
-            }
             out["maps"].append(entry)
-        text_widget.insert(END, "\nDone. Rendering JSON...\n\n")
-        rendered = json.dumps(out, ensure_ascii=False, indent=2)
-        text_widget.insert(END, rendered + "\n")
-        text_widget.config(state=DISABLED)
-        # Prompt to save
-        save_path = filedialog.asksaveasfilename(
-            title="Save output JSON",
-            defaultextension=".json",
-            filetypes=[("JSON files", ".json"), ("All files", ".*")],
-            initialfile=f"{author}_{prefix}_times.json",
+            rows[result.uid] = len(out["maps"])
+            progress.put(("entry", len(out["maps"]), entry))
+        st = times_net.pool_stats()
+        http_note = (
+            f"HTTP: {st['requests']} request(s) over {st['connections']} connection(s), "
+            f"{st['reused']} reused ({st['reuse_ratio']:.0%})"
         )
-        if save_path:
-            with open(save_path, "w", encoding="utf-8") as f:
-                f.write(rendered)
-            messagebox.showinfo("Saved", f"Results saved to:\n{save_path}")
+        if skipped[0]:
+            http_note += f". {skipped[0]} map(s) without UID skipped"
+        if pipeline.missing:
+            http_note += f". {len(pipeline.missing)} map(s) missing (host unavailable)"
+        progress.put(("done", out, cancel.is_set(), http_note))
     except Exception as e:
-        text_widget.config(state=NORMAL)
-        text_widget.insert(END, f"\nError: {e}\n")
-        text_widget.config(state=DISABLED)
-        messagebox.showerror("Error", str(e))
-    finally:
-        calculate_btn.config(state=NORMAL)
+        progress.put(("error", str(e)))
 
 
 def launch_ui():
@@ -111,19 +114,98 @@ def launch_ui():
 
     Label(root, text="Author name:").grid(row=0, column=0, sticky="w", padx=6, pady=6)
     author_entry = Entry(root, width=40)
-    author_entry.grid(row=0, column=1, sticky="we", padx=6, pady=6)
+    author_entry.grid(row=0, column=1, columnspan=2, sticky="we", padx=6, pady=6)
 
     Label(root, text="Map prefix:").grid(row=1, column=0, sticky="w", padx=6, pady=6)
     prefix_entry = Entry(root, width=40)
-    prefix_entry.grid(row=1, column=1, sticky="we", padx=6, pady=6)
+    prefix_entry.grid(row=1, column=1, columnspan=2, sticky="we", padx=6, pady=6)
 
     Label(root, text="User-Agent (optional):").grid(row=2, column=0, sticky="w", padx=6, pady=6)
     ua_entry = Entry(root, width=40)
     ua_entry.insert(0, DEFAULT_UA)
-    ua_entry.grid(row=2, column=1, sticky="we", padx=6, pady=6)
+    ua_entry.grid(row=2, column=1, columnspan=2, sticky="we", padx=6, pady=6)
+
+    Label(root, text="Parallel maps:").grid(row=3, column=0, sticky="w", padx=6, pady=6)
+    workers_entry = Entry(root, width=6)
+    workers_entry.insert(0, str(DEFAULT_WORKERS))
+    workers_entry.grid(row=3, column=1, sticky="w", padx=6, pady=6)
 
-    output = Text(root, height=24, width=90, state=DISABLED)
-    output.grid(row=3, column=0, columnspan=2, padx=6, pady=6, sticky="nsew")
+    Label(root, text="Max maps (blank = all):").grid(row=4, column=0, sticky="w", padx=6, pady=6)
+    max_maps_entry = Entry(root, width=6)
+    max_maps_entry.grid(row=4, column=1, sticky="w", padx=6, pady=6)
+
+    table = ttk.Treeview(root, columns=[c[0] for c in TABLE_COLUMNS], show="headings", height=20)
+    for key, title, width in TABLE_COLUMNS:
+        table.heading(key, text=title)
+        table.column(key, width=width, anchor="w" if key == "name" else "e", stretch=(key == "name"))
+    table.grid(row=5, column=0, columnspan=3, padx=6, pady=6, sticky="nsew")
+    scroll = ttk.Scrollbar(root, orient="vertical", command=table.yview)
+    scroll.grid(row=5, column=3, sticky="ns", pady=6)
+    table.configure(yscrollcommand=scroll.set)
+
+    progress_bar = ttk.Progressbar(root, orient="horizontal", mode="determinate")
+    progress_bar.grid(row=6, column=0, columnspan=3, sticky="we", padx=6)
+    status = StringVar(value="Idle.")
+    Label(root, textvariable=status, anchor="w").grid(row=7, column=0, columnspan=3, sticky="we", padx=6, pady=4)
+
+    state = {"queue": None, "cancel": None}
+
+    def finish(out, cancelled: bool, http_note: str):
+        calc_btn.config(state=NORMAL)
+        cancel_btn.config(state=DISABLED)
+        word = "Cancelled" if cancelled else "Done"
+        status.set(f"{word}: {len(out['maps'])} map(s). {http_note}")
+        if not out["maps"]:
+            return
+        save_path = filedialog.asksaveasfilename(
+            title="Save output JSON",
+            defaultextension=".json",
+            filetypes=[("JSON files", ".json"), ("All files", ".*")],
+            initialfile=f"{out['author']}_{out['prefix']}_times.json",
+        )
+        if save_path:
+            with open(save_path, "w", encoding="utf-8") as f:
+                json.dump(out, f, ensure_ascii=False, indent=2)
+            slim_path = os.path.splitext(save_path)[0] + ".slim.json"
+            times_output.write_slim(times_output.slim_document(out), slim_path)
+            messagebox.showinfo("Saved", f"Results saved to:\n{save_path}\n\nPlugin projection:\n{slim_path}")
+
+    def drain():
+        """Apply queued progress messages on the Tk thread, a bounded batch per tick."""
+        q = state["queue"]
+        if q is None:
+            return
+        for _ in range(200):
+            try:
+                msg = q.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if kind == "status":
+                status.set(msg[1])
+            elif kind == "found":
+                progress_bar.config(maximum=max(1, msg[1]))
+            elif kind == "entry":
+                done, entry = msg[1], msg[2]
+                table.insert("", "end", iid=str(done), values=row_values(done, entry))
+                progress_bar.config(value=done)
+                status.set(f"[{done}/{int(progress_bar['maximum'])}] {entry.get('name')}")
+            elif kind == "retried":
+                n, entry = msg[1], msg[2]
+                table.item(str(n), values=row_values(n, entry))
+                status.set(f"Retried {entry.get('name')} ({entry['retried']['reason']})")
+            elif kind == "done":
+                state["queue"] = None
+                finish(msg[1], msg[2], msg[3])
+                return
+            elif kind == "error":
+                state["queue"] = None
+                calc_btn.config(state=NORMAL)
+                cancel_btn.config(state=DISABLED)
+                status.set(f"Error: {msg[1]}")
+                messagebox.showerror("Error", msg[1])
+                return
+        root.after(POLL_MS, drain)
 
     def on_calculate():
         author = author_entry.get().strip()
@@ -132,19 +214,44 @@ def launch_ui():
         if not author or not prefix:
             messagebox.showwarning("Missing input", "Please enter both author and prefix.")
             return
-        output.config(state=NORMAL)
-        output.delete(1.0, END)
-        output.insert(END, "Starting... this may take a while for many maps.\n")
-        output.config(state=DISABLED)
+        try:
+            workers = max(1, int(workers_entry.get().strip() or DEFAULT_WORKERS))
+        except ValueError:
+            messagebox.showwarning("Invalid input", "Parallel maps must be a whole number.")
+            return
+        try:
+            max_maps = int(max_maps_entry.get().strip()) if max_maps_entry.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("Invalid input", "Max maps must be a whole number or blank.")
+            return
+        table.delete(*table.get_children())
+        progress_bar.config(value=0, maximum=1)
+        status.set("Starting... this may take a while for many maps.")
         calc_btn.config(state=DISABLED)
-        t = threading.Thread(target=compute_and_render, args=(author, prefix, ua, output, calc_btn), daemon=True)
+        cancel_btn.config(state=NORMAL)
+        state["queue"] = queue.Queue()
+        state["cancel"] = threading.Event()
+        t = threading.Thread(
+            target=compute_worker,
+            args=(author, prefix, ua, workers, max_maps, state["queue"], state["cancel"]),
+            daemon=True,
+        )
         t.start()
+        root.after(POLL_MS, drain)
+
+    def on_cancel():
+        if state["cancel"] is not None:
+            state["cancel"].set()
+            status.set("Cancelling... waiting for maps in flight.")
+            cancel_btn.config(state=DISABLED)
 
     calc_btn = Button(root, text="Calculate", command=on_calculate)
-    calc_btn.grid(row=4, column=0, columnspan=2, pady=8)
+    calc_btn.grid(row=8, column=1, pady=8, sticky="e")
+    cancel_btn = Button(root, text="Cancel", command=on_cancel, state=DISABLED)
+    cancel_btn.grid(row=8, column=2, pady=8, sticky="w", padx=6)
 
     root.grid_columnconfigure(1, weight=1)
-    root.grid_rowconfigure(3, weight=1)
+    root.grid_rowconfigure(5, weight=1)
 
     root.mainloop()
 
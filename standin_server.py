@@ -0,0 +1,322 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class FirebaseStore:
+    """In-memory JSON tree with the subset of Firebase Realtime Database REST semantics we use."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        self.data: Dict[str, Any] = data or {}
+        self.lock = threading.Lock()
+        self.requests: List[Tuple[str, str]] = []
+
+    @staticmethod
+    def _parts(path: str) -> List[str]:
+        if path.endswith(".json"):
+            path = path[: -len(".json")]
+        return [p for p in path.split("/") if p]
+
+    def get(self, path: str) -> Any:
+        node: Any = self.data
+        for p in self._parts(path):
+            if not isinstance(node, dict) or p not in node:
+                return None
+            node = node[p]
+        return node
+
+    def _set(self, parts: List[str], value: Any) -> None:
+        if not parts:
+            self.data = value if isinstance(value, dict) else {}
+            return
+        node = self.data
+        for p in parts[:-1]:
+            child = node.get(p)
+            if not isinstance(child, dict):
+                child = {}
+                node[p] = child
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    def put(self, path: str, value: Any) -> None:
+        self._set(self._parts(path), value)
+
+    def patch(self, path: str, updates: Dict[str, Any]) -> None:
+        """Multi-path update: each key may itself be a `a/b/c` path below `path`."""
+        base = self._parts(path)
+        for key, value in updates.items():
+            self._set(base + [p for p in key.split("/") if p], value)
+
+
+def make_handler(store: FirebaseStore):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out as separate writes; without TCP_NODELAY the body waits on a delayed ACK
+        disable_nagle_algorithm = True
+
+        def _reply(self, status: int, body: Any) -> None:
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _body(self) -> Any:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"null")
+
+        def do_GET(self) -> None:
+            path = urlsplit(self.path).path
+            with store.lock:
+                store.requests.append(("GET", path))
+                self._reply(200, store.get(path))
+
+        def do_PUT(self) -> None:
+            path = urlsplit(self.path).path
+            value = self._body()
+            with store.lock:
+                store.requests.append(("PUT", path))
+                store.put(path, value)
+            self._reply(200, value)
+
+        def do_PATCH(self) -> None:
+            path = urlsplit(self.path).path
+            updates = self._body()
+            if not isinstance(updates, dict):
+                self._reply(400, {"error": "Invalid data; couldn't parse JSON object"})
+                return
+            with store.lock:
+                store.requests.append(("PATCH", path))
+                store.patch(path, updates)
+            self._reply(200, updates)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+class FaultConfig:
+    """Latency and error injection applied to every stand-in request."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        p429: float = 0.0,
+        p5xx: float = 0.0,
+        retry_after: Optional[float] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.p429 = p429
+        self.p5xx = p5xx
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> Tuple[float, Optional[int]]:
+        """Return (delay_seconds, injected_status or None) for one request."""
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter > 0 else 0.0)
+            r = self._rng.random()
+        if r < self.p429:
+            return delay, 429
+        if r < self.p429 + self.p5xx:
+            return delay, 503
+        return delay, None
+
+
+class Recording:
+    """Recorded TMX/TMIO data served by the Trackmania stand-in.
+
+    File layout: {"maps": [TMX /api/maps results], "leaderboards": {uid: [TMIO tops]},
+    "authorTimes": {uid: ms}, "replays": {mapId: [TMX /api/replays results]}}.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.maps: List[Dict[str, Any]] = list(data.get("maps") or [])
+        self.leaderboards: Dict[str, List[Dict[str, Any]]] = dict(data.get("leaderboards") or {})
+        self.author_times: Dict[str, int] = dict(data.get("authorTimes") or {})
+        self.replays: Dict[str, List[Dict[str, Any]]] = {str(k): v for k, v in (data.get("replays") or {}).items()}
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def synthetic(cls, n_maps: int, author: str = "uncleblowtorch", prefix: str = "UBU", records: int = 50, seed: int = 0) -> "Recording":
+        """Deterministic fake campaign of `n_maps` maps with `records` leaderboard entries each."""
+        rng = random.Random(seed)
+        maps, boards, ats, replays = [], {}, {}, {}
+        for i in range(n_maps):
+            map_id = 100000 + i
+            uid = f"SynthUid{i:05d}xxxxxxxxxxxxx"
+            at = rng.randint(30000, 90000)
+            maps.append({
+                "MapId": map_id,
+                "MapUid": uid,
+                "Name": f"{prefix} {i + 1:03d}",
+                "Uploader": {"Name": author},
+                "Medals": {"Author": at},
+                "ReplayCount": records,
+            })
+            wr = at - rng.randint(500, 4000)
+            times = sorted(wr + rng.randint(0, at - wr + 2000) for _ in range(records))
+            times[0] = wr
+            boards[uid] = [{"position": p + 1, "time": t} for p, t in enumerate(times)]
+            ats[uid] = at
+            replays[str(map_id)] = [
+                {"ReplayId": map_id * 1000 + p, "Position": p + 1, "ReplayTime": t} for p, t in enumerate(times)
+            ]
+        return cls({"maps": maps, "leaderboards": boards, "authorTimes": ats, "replays": replays})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"maps": self.maps, "leaderboards": self.leaderboards, "authorTimes": self.author_times, "replays": self.replays}
+
+
+def _after_page(items: List[Dict[str, Any]], id_key: str, after: Optional[str], count: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """TMX cursor pagination: items with `id_key` greater than `after`, plus the `More` flag."""
+    if after:
+        try:
+            cursor = int(after)
+            items = [m for m in items if int(m.get(id_key) or 0) > cursor]
+        except ValueError:
+            items = []
+    return items[:count], len(items) > count
+
+
+def make_trackmania_handler(recording: Recording, faults: Optional[FaultConfig] = None):
+    """Handler answering the TMX (/api/maps, /api/replays, /mapsearch2) and TMIO
+    (/api/leaderboard/map/{uid}, /api/map/{uid}) endpoints the generator calls."""
+    faults = faults or FaultConfig()
+    counts: Dict[str, int] = {}
+    counts_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+        request_counts = counts
+
+        def _reply(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self) -> None:
+            parts = urlsplit(self.path)
+            path = parts.path
+            q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            with counts_lock:
+                counts[path] = counts.get(path, 0) + 1
+            delay, status = faults.roll()
+            if delay > 0:
+                time.sleep(delay)
+            if status == 429:
+                headers = {"Retry-After": str(faults.retry_after)} if faults.retry_after is not None else None
+                self._reply(429, {"error": "Too Many Requests"}, headers)
+                return
+            if status is not None:
+                self._reply(status, {"error": "Service Unavailable"})
+                return
+
+            count = int(q.get("count") or q.get("length") or 40)
+            if path == "/api/maps":
+                name = (q.get("name") or "").lower()
+                matches = [m for m in recording.maps if name in str(m.get("Name") or "").lower()]
+                page, more = _after_page(matches, "MapId", q.get("after"), count)
+                self._reply(200, {"Results": page, "More": more})
+            elif path == "/api/replays":
+                page, more = _after_page(recording.replays.get(q.get("mapId") or "", []), "ReplayId", q.get("after"), count)
+                self._reply(200, {"Results": page, "More": more})
+            elif path.startswith("/api/replays/get_replays/"):
+                self._reply(200, recording.replays.get(path.rsplit("/", 1)[-1], [])[:count])
+            elif path == "/mapsearch2/search":
+                self._reply(200, {"results": [], "totalItemCount": 0})
+            elif path.startswith("/api/leaderboard/map/"):
+                tops = recording.leaderboards.get(path.rsplit("/", 1)[-1], [])
+                offset = int(q.get("offset") or 0)
+                self._reply(200, {"tops": tops[offset:offset + min(count, 100)]})
+            elif path.startswith("/api/map/"):
+                uid = path.rsplit("/", 1)[-1]
+                if uid not in recording.author_times:
+                    self._reply(404, {"error": "map not found"})
+                    return
+                self._reply(200, {"mapUid": uid, "authorScore": recording.author_times[uid]})
+            else:
+                self._reply(404, {"error": "unknown endpoint"})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def serve(handler_cls, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start `handler_cls` on a background thread; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), handler_cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="Local stand-in HTTP servers for offline runs")
+    sub = ap.add_subparsers(dest="kind", required=True)
+    fb = sub.add_parser("firebase", help="Firebase Realtime Database REST stand-in")
+    fb.add_argument("--host", default="127.0.0.1")
+    fb.add_argument("--port", type=int, default=8765)
+    fb.add_argument("--seed", default=None, help="JSON file with the initial database tree")
+    tm = sub.add_parser("trackmania", help="TMX + TMIO stand-in replaying a recording")
+    tm.add_argument("--host", default="127.0.0.1")
+    tm.add_argument("--port", type=int, default=8766)
+    src = tm.add_mutually_exclusive_group(required=True)
+    src.add_argument("--recording", help="Recording JSON file (see Recording)")
+    src.add_argument("--synthetic", type=int, help="Serve a synthetic campaign with this many maps")
+    tm.add_argument("--records", type=int, default=50, help="Leaderboard size of each synthetic map")
+    tm.add_argument("--latency", type=float, default=0.0, help="Base response delay in seconds")
+    tm.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random delay up to this many seconds")
+    tm.add_argument("--p429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    tm.add_argument("--p5xx", type=float, default=0.0, help="Fraction of requests answered with 503")
+    tm.add_argument("--retry-after", type=float, default=None, help="Retry-After value sent with injected 429s")
+    args = ap.parse_args(argv)
+
+    if args.kind == "firebase":
+        seed = None
+        if args.seed:
+            with open(args.seed, "r", encoding="utf-8") as f:
+                seed = json.load(f)
+        handler = make_handler(FirebaseStore(seed))
+    else:
+        recording = Recording.load(args.recording) if args.recording else Recording.synthetic(args.synthetic, records=args.records)
+        faults = FaultConfig(args.latency, args.jitter, args.p429, args.p5xx, args.retry_after)
+        handler = make_trackmania_handler(recording, faults)
+    server = serve(handler, args.host, args.port)
+    print(f"{args.kind} stand-in on http://{args.host}:{server.server_port}/ (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,1030 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional: MedalEngine falls back to pure Python
+    np = None
+
+import times_net
+from times_net import (
+    REQUEST_TIMING,
+    FetchError,
+    fetch_replays,
+    fetch_replays_fallback_get,
+    fetch_tmio_author_time,
+    fetch_tmio_leaderboard,
+    map_timer,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@functools.lru_cache(maxsize=64)
+def weight_vector(c: float, n: int) -> Tuple[Tuple[float, ...], float]:
+    """Time_A weights c ** (21 - i) for i = 1..n and their sum, built once per (c, n).
+
+    The sum is accumulated in the same order as the original loop so results stay bit-identical.
+    """
+    weights = tuple(c ** (21 - i) for i in range(1, n + 1))
+    den = 0.0
+    for w in weights:
+        den += w
+    return weights, den
+
+
+def compute_time_a(times_ms: List[int], c: float = 1.1, n: int = 50) -> Optional[float]:
+    if len(times_ms) < n:
+        return None
+    weights, den = weight_vector(c, n)
+    num = 0.0
+    for w, t in zip(weights, times_ms[:n]):
+        num += w * t
+    if den == 0:
+        return None
+    return num / den
+
+
+def compute_time_b(t_at: int, t_wr: int, f: float = 0.5) -> float:
+    diff = t_at - t_wr
+    return t_at - f * diff
+
+
+def compute_harder_time(t_at: int, t_wr: int, factor: Optional[float] = 0.25) -> int:
+    """1/4 of the way from AuthorTime toward WR by default. Always at least 1 ms faster than AT."""
+    if t_at is None or t_wr is None:
+        return int(t_at or 0)
+    f = 0.25 if factor is None else factor
+    try:
+        offs = int((int(t_at) - int(t_wr)) * f)
+    except Exception:
+        offs = 0
+    return int(t_at) - max(offs, 1)
+
+
+class MedalResult:
+    """Medals computed for one map, plus the provenance the output records about them."""
+
+    __slots__ = (
+        "author_time",
+        "wr_time",
+        "records_count",
+        "time_a",
+        "time_b",
+        "harder",
+        "medal",
+        "method",
+        "leaderboard_hash",
+        "author_time_source",
+        "source",
+    )
+
+    def __init__(
+        self,
+        author_time: int,
+        wr_time: int,
+        records_count: int,
+        time_a: Optional[int],
+        time_b: int,
+        harder: int,
+        medal: int,
+        method: str,
+    ):
+        self.author_time = author_time
+        self.wr_time = wr_time
+        self.records_count = records_count
+        self.time_a = time_a
+        self.time_b = time_b
+        self.harder = harder
+        self.medal = medal
+        self.method = method
+        self.leaderboard_hash: Optional[str] = None
+        self.author_time_source: Optional[str] = None
+        self.source = "tmio"
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The flat dict `compute_from_times` has always returned."""
+        out = {
+            "authorTime_ms": self.author_time,
+            "wrTime_ms": self.wr_time,
+            "recordsCount": self.records_count,
+            "timeA_ms": self.time_a,
+            "timeB_ms": self.time_b,
+            "harderTime_ms": self.harder,
+            "medalTime_ms": self.medal,
+            "method": self.method,
+        }
+        if self.leaderboard_hash is not None:
+            out["leaderboardHash"] = self.leaderboard_hash
+        if self.author_time_source is not None:
+            out["authorTimeSource"] = self.author_time_source
+        return out
+
+
+class MedalEngine:
+    """Time_A / Time_B / harder medal computation for one or many maps.
+
+    `evaluate` is the reference implementation behind `compute_from_times`. `evaluate_batch`
+    evaluates the Time_A weighted sums of many maps in one NumPy matrix product when
+    NumPy is installed; any result whose fractional part lands close enough to .5 that
+    summation order could flip the rounding is redone in pure Python, so batch output is
+    always identical to `evaluate`. `compute` and `compute_batch` return the same as dicts.
+    """
+
+    def __init__(
+        self,
+        c: float = 1.1,
+        n: int = 50,
+        time_b_factor: float = 0.5,
+        harder_factor: float = 0.125,
+        use_numpy: Optional[bool] = None,
+    ):
+        self.c = c
+        self.n = n
+        self.time_b_factor = time_b_factor
+        self.harder_factor = harder_factor
+        self.use_numpy = (np is not None) if use_numpy is None else (use_numpy and np is not None)
+
+    @staticmethod
+    def clean_times(times: List[Any]) -> List[int]:
+        if set(map(type, times)) <= {int}:
+            return sorted(times)
+        out = [int(t) for t in times if isinstance(t, (int, float))]
+        out.sort()
+        return out
+
+    def _result(self, t_at: int, times: List[int], time_a_val: Optional[float]) -> MedalResult:
+        records_count = len(times)
+        t_wr = times[0] if records_count > 0 else t_at
+        time_b = compute_time_b(int(t_at or 0), int(t_wr or 0), self.time_b_factor)
+        harder = compute_harder_time(int(t_at or 0), int(t_wr or 0), self.harder_factor)
+        if time_a_val is None:
+            medal = time_b
+            method = "Time_B"
+        else:
+            medal = time_a_val
+            method = "Time_A"
+        return MedalResult(
+            int(t_at or 0),
+            int(t_wr or 0),
+            records_count,
+            int(round(time_a_val)) if time_a_val is not None else None,
+            int(round(time_b)),
+            int(harder),
+            int(round(medal)),
+            method,
+        )
+
+    def evaluate(self, t_at: int, times: List[Any]) -> MedalResult:
+        times = self.clean_times(times)
+        time_a_val = compute_time_a(times, self.c, self.n) if len(times) >= self.n else None
+        return self._result(t_at, times, time_a_val)
+
+    def compute(self, t_at: int, times: List[Any]) -> Dict[str, Any]:
+        return self.evaluate(t_at, times).as_dict()
+
+    def compute_batch(self, rows: Iterable[Tuple[int, List[Any]]]) -> List[Dict[str, Any]]:
+        return [r.as_dict() for r in self.evaluate_batch(rows)]
+
+    def evaluate_batch(self, rows: Iterable[Tuple[int, List[Any]]]) -> List[MedalResult]:
+        """Compute many maps at once; `rows` are (author_time_ms, times) pairs."""
+        cleaned = [(t_at, self.clean_times(times)) for t_at, times in rows]
+        full = [i for i, (_, times) in enumerate(cleaned) if len(times) >= self.n]
+        time_a: Dict[int, Optional[float]] = {}
+        if full and self.use_numpy:
+            weights, den = weight_vector(self.c, self.n)
+            matrix = np.array([cleaned[i][1][: self.n] for i in full], dtype=np.float64)
+            values = (matrix @ np.array(weights, dtype=np.float64)) / den
+            for i, v in zip(full, values.tolist()):
+                if abs((v % 1.0) - 0.5) < 1e-6:
+                    v = compute_time_a(cleaned[i][1], self.c, self.n)
+                time_a[i] = v
+        else:
+            for i in full:
+                time_a[i] = compute_time_a(cleaned[i][1], self.c, self.n)
+        return [self._result(t_at, times, time_a.get(i)) for i, (t_at, times) in enumerate(cleaned)]
+
+
+_ENGINE = MedalEngine()
+
+
+# Records fetched per map (--depth) and records Time_A averages over (--time-a-n)
+LEADERBOARD_DEPTH = 50
+
+
+def configure_leaderboard(depth: int = 50, time_a_n: int = 50) -> None:
+    global LEADERBOARD_DEPTH, _ENGINE
+    LEADERBOARD_DEPTH = max(1, int(depth))
+    _ENGINE = MedalEngine(n=max(1, int(time_a_n)))
+
+
+def medal_engine() -> MedalEngine:
+    """The engine `configure_leaderboard` set up; the pipeline computes every map with it."""
+    return _ENGINE
+
+
+def leaderboard_settings(engine: Optional[MedalEngine] = None) -> Dict[str, Any]:
+    """The settings an entry's medals depend on besides its leaderboard; reusing it requires them to match."""
+    engine = engine or _ENGINE
+    return {
+        "depth": LEADERBOARD_DEPTH,
+        "timeA_n": engine.n,
+        "c": engine.c,
+        "timeB_factor": engine.time_b_factor,
+        "harder_factor": engine.harder_factor,
+    }
+
+
+def compute_from_times(t_at: int, times: List[int]) -> Dict[str, Any]:
+    """Compute Time_A/Time_B/Medal from author time and a list of top times (ms)."""
+    return _ENGINE.compute(t_at, times)
+
+
+def tmx_author_time(m: Dict[str, Any]) -> int:
+    """Author time in ms from a TMX map record, or 0 when it has none."""
+    # Author time can be under AuthorTime (older) or Medals.Author (v2 maps)
+    medals = m.get("Medals") or {}
+    at_val = m.get("AuthorTime") if m.get("AuthorTime") is not None else medals.get("Author")
+    try:
+        return int(at_val if at_val is not None else 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def times_from_replays(replays: List[Dict[str, Any]], depth: int = 50) -> List[int]:
+    """ReplayTime of the TMX replays ranked 1..`depth`, skipping malformed rows."""
+    times: List[int] = []
+    for r in replays:
+        pos = r.get("Position")
+        if pos is None:
+            continue
+        try:
+            pos_i = int(pos)
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= pos_i <= depth:
+            continue
+        rt = r.get("ReplayTime")
+        if rt is None:
+            continue
+        try:
+            times.append(int(rt))
+        except (TypeError, ValueError):
+            continue
+    return times
+
+
+def compute_for_map(m: Dict[str, Any], replays: List[Dict[str, Any]]) -> Dict[str, Any]:
+    try:
+        t_at = tmx_author_time(m)
+        # Use positions 1-50 (aligned with TMIO top length)
+        times = times_from_replays(replays, 50)
+        # No usable replays falls back to AuthorTime as WR inside the engine
+        return _ENGINE.compute(t_at, times)
+    except Exception as e:
+        return {
+            "authorTime_ms": 0,
+            "wrTime_ms": 0,
+            "recordsCount": 0,
+            "timeA_ms": None,
+            "timeB_ms": 0.0,
+            "medalTime_ms": 0.0,
+            "method": f"Error: {str(e)}",
+        }
+
+
+def times_from_tops(tops: List[Dict[str, Any]]) -> List[int]:
+    """Extract the integer `time` values from a TMIO `tops` list, skipping malformed rows."""
+    times: List[int] = []
+    for e in tops:
+        t = e.get("time") if isinstance(e, dict) else None
+        if t is None:
+            continue
+        try:
+            times.append(int(t))
+        except (TypeError, ValueError):
+            continue
+    return times
+
+
+def leaderboard_hash(times: List[int]) -> str:
+    """Short content hash of a leaderboard's times, stored per entry to detect unchanged boards."""
+    raw = ",".join(str(t) for t in sorted(times))
+    return hashlib.sha1(raw.encode("ascii")).hexdigest()[:16]
+
+
+class MapRecord:
+    """The TMX fields a map carries through the pipeline; the raw search result is not kept."""
+
+    __slots__ = ("uid", "track_id", "name", "author", "tmx_author_time")
+
+    def __init__(
+        self,
+        uid: str,
+        track_id: Optional[int] = None,
+        name: Optional[str] = None,
+        author: Optional[str] = None,
+        tmx_author_time: int = 0,
+    ):
+        self.uid = uid
+        self.track_id = track_id
+        self.name = name
+        self.author = author
+        self.tmx_author_time = tmx_author_time
+
+    @classmethod
+    def from_tmx(cls, m: Dict[str, Any]) -> Optional["MapRecord"]:
+        """Record for a TMX search result, or None if it has no UID (TMIO-only)."""
+        uid = m.get("MapUid") or m.get("TrackUID")
+        if not isinstance(uid, str) or not uid:
+            return None
+        track_id_val = m.get("MapId") or m.get("TrackID") or m.get("TrackId")
+        try:
+            track_id = int(track_id_val)
+        except (TypeError, ValueError):
+            track_id = None
+        return cls(
+            uid,
+            track_id,
+            m.get("Name") or m.get("TrackName"),
+            m.get("Username") or (m.get("Uploader") or {}).get("Name"),
+            tmx_author_time(m),
+        )
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "MapRecord":
+        """Record recovered from an existing output entry."""
+        return cls(entry["uid"], entry.get("trackId"), entry.get("name"), entry.get("author"))
+
+    def meta(self) -> Dict[str, Any]:
+        """TMX-shaped fields that `from_tmx` reads back, for storing outside the process."""
+        return {"MapId": self.track_id, "Name": self.name, "Username": self.author}
+
+
+class Leaderboard:
+    """One fetch of a map's TMIO top times, in the order TMIO served them."""
+
+    __slots__ = ("uid", "times", "_hash")
+
+    def __init__(self, uid: str, times: List[int]):
+        self.uid = uid
+        self.times = times
+        self._hash: Optional[str] = None
+
+    @classmethod
+    def fetch(cls, uid: str, user_agent: str, fresh: bool = False) -> "Leaderboard":
+        return cls(uid, times_from_tops(fetch_tmio_leaderboard(uid, user_agent, LEADERBOARD_DEPTH, fresh)))
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = leaderboard_hash(self.times)
+        return self._hash
+
+
+def compute_map_tmio(
+    uid: str,
+    user_agent: str,
+    known_author_time: Optional[int] = None,
+    board: Optional[Leaderboard] = None,
+    on_result: Optional[Callable[[int, List[int]], None]] = None,
+    fresh: bool = False,
+) -> MedalResult:
+    """Fetch TMIO author time + top records (LEADERBOARD_DEPTH) for a UID and compute medals.
+
+    A positive `known_author_time` skips the author-time request; `board` skips the
+    leaderboard request when the caller already has it. `on_result` receives the author
+    time and leaderboard the medals were computed from. Sparse results are not refetched
+    here: `Pipeline` hands them to a `RetryQueue` (with `fresh` set, bypassing caches).
+    """
+    t_at = int(known_author_time or 0)
+    from_tmio = not t_at
+    if from_tmio:
+        t_at = fetch_tmio_author_time(uid, user_agent, fresh) or 0
+    if board is None:
+        board = Leaderboard.fetch(uid, user_agent, fresh)
+    medals = _ENGINE.evaluate(t_at, board.times)
+    medals.leaderboard_hash = board.hash
+    if from_tmio:
+        medals.author_time_source = "tmio"
+    if on_result is not None:
+        on_result(medals.author_time, board.times)
+    return medals
+
+
+def compute_map_replays(
+    rec: MapRecord,
+    user_agent: str,
+    known_author_time: Optional[int] = None,
+    on_result: Optional[Callable[[int, List[int]], None]] = None,
+) -> MedalResult:
+    """Medals from the TMX replay leaderboard (`/api/replays?best=1`, then the legacy list).
+
+    The author time is `known_author_time` when positive, else the TMX one from `rec`.
+    """
+    replays = fetch_replays(rec.track_id, user_agent)
+    if not replays:
+        replays = fetch_replays_fallback_get(rec.track_id, user_agent, LEADERBOARD_DEPTH)
+    times = times_from_replays(replays, LEADERBOARD_DEPTH)
+    t_at = int(known_author_time or 0)
+    medals = _ENGINE.evaluate(t_at or rec.tmx_author_time, times)
+    medals.leaderboard_hash = leaderboard_hash(times)
+    medals.source = "tmx_replays"
+    if not t_at:
+        medals.author_time_source = "tmx"
+    if on_result is not None:
+        on_result(medals.author_time, times)
+    return medals
+
+
+# Hedged fetching: when TMIO has not answered a map within HEDGE_AFTER seconds, or answered
+# with a sparse board, the TMX replay source is started alongside it (None = off)
+HEDGE_AFTER: Optional[float] = None
+
+
+def configure_hedging(after: Optional[float]) -> None:
+    global HEDGE_AFTER
+    HEDGE_AFTER = None if after is None else max(0.0, float(after))
+
+
+def _start_attempt(fn: Callable[[], T]) -> "Future[T]":
+    """Run `fn` on a thread of its own. Hedge attempts are never queued: with a bounded pool,
+    losers still waiting on a slow source would hold the threads the next map's hedge needs."""
+    fut: "Future[T]" = Future()
+
+    def run() -> None:
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return fut
+
+
+def _acceptable(medals: MedalResult) -> bool:
+    return bool(medals.author_time) and medals.records_count >= SPARSE_RECORDS
+
+
+def hedged_medals(
+    rec: MapRecord,
+    user_agent: str,
+    known_author_time: Optional[int] = None,
+    board: Optional[Leaderboard] = None,
+    on_result: Optional[Callable[[int, List[int]], None]] = None,
+) -> MedalResult:
+    """`compute_map_tmio`, hedged with `compute_map_replays` (see HEDGE_AFTER).
+
+    The first acceptable result (an author time and at least SPARSE_RECORDS records)
+    wins; when neither is acceptable, the one with more records does, TMIO on a tie.
+    The loser is left to finish in the background and discarded. `on_result` only
+    sees the winner.
+    """
+    acc = getattr(REQUEST_TIMING, "acc", None)
+
+    def attempt(fn: Callable[..., MedalResult], *args: Any) -> Future:
+        def run() -> Tuple[MedalResult, List[int]]:
+            # Attribute this source's requests to the map being timed, if any
+            REQUEST_TIMING.acc = acc
+            boards: List[List[int]] = []
+            try:
+                medals = fn(*args, on_result=lambda at, times: boards.append(times))
+            finally:
+                REQUEST_TIMING.acc = None
+            return medals, boards[0]
+
+        return _start_attempt(run)
+
+    def usable(f: Future) -> bool:
+        return f.exception() is None and _acceptable(f.result()[0])
+
+    tmio = attempt(compute_map_tmio, rec.uid, user_agent, known_author_time, board)
+    done, _ = wait([tmio], timeout=HEDGE_AFTER)
+    if tmio in done and usable(tmio):
+        winner = tmio
+    else:
+        times_net.METRICS.hedge("started")
+        futures = [tmio, attempt(compute_map_replays, rec, user_agent, known_author_time)]
+        winner = None
+        pending = set(futures)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in futures if f in done and usable(f)), None)
+        if winner is None:
+            ok = [f for f in futures if f.exception() is None]
+            if not ok:
+                raise tmio.exception()
+            winner = max(ok, key=lambda f: f.result()[0].records_count)
+        times_net.METRICS.hedge("won_" + winner.result()[0].source)
+    medals, times = winner.result()
+    if on_result is not None:
+        on_result(medals.author_time, times)
+    return medals
+
+
+def build_entry(rec: MapRecord, medals: MedalResult, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Serialize one map to the output JSON shape; the only place that shape is spelled out.
+
+    `settings` defaults to the run's `leaderboard_settings()`.
+    """
+    track_id = rec.track_id
+    uid = rec.uid
+    return {
+        "trackId": track_id,
+        "uid": uid,
+        "name": rec.name,
+        "author": rec.author,
+        "authorTime_ms": medals.author_time,
+        "wrTime_ms": medals.wr_time,
+        "recordsCount": medals.records_count,
+        "leaderboardHash": medals.leaderboard_hash,
+        "computed": {
+            "timeA_ms": medals.time_a,
+            "timeB_ms": medals.time_b,
+            "harderTime_ms": medals.harder,
+            "medalTime_ms": medals.medal,
+            "method": medals.method,
+            "settings": settings or leaderboard_settings(),
+        },
+        "source": {
+            "tmx_map_url": f"https://trackmania.exchange/maps/{track_id}" if track_id is not None else None,
+            "tmio_leaderboard_url": f"https://trackmania.io/api/leaderboard/map/{uid}?offset=0&length={LEADERBOARD_DEPTH}",
+            "tmio_map_url": f"https://trackmania.io/api/map/{uid}",
+            "api_search": "https://trackmania.exchange/api/maps",
+            "source_preference": medals.source,
+            "author_time": medals.author_time_source,
+        },
+    }
+
+
+class MapResult:
+    """One map's outcome from the pipeline: fresh medals, or an entry reused from a previous output.
+
+    Turned into the output dict only by `to_entry`, so the pipeline itself never holds
+    nested per-map dicts beyond the reused ones it was given.
+    """
+
+    __slots__ = ("map", "medals", "reused", "retried", "timing")
+
+    def __init__(self, rec: MapRecord, medals: Optional[MedalResult] = None, reused: Optional[Dict[str, Any]] = None):
+        self.map = rec
+        self.medals = medals
+        self.reused = reused
+        self.retried: Optional[Dict[str, Any]] = None
+        self.timing: Optional[Dict[str, float]] = None
+
+    @property
+    def uid(self) -> str:
+        return self.map.uid
+
+    @property
+    def author_time(self) -> int:
+        if self.medals is not None:
+            return self.medals.author_time
+        return int(self.reused.get("authorTime_ms") or 0)
+
+    @property
+    def records_count(self) -> int:
+        if self.medals is not None:
+            return self.medals.records_count
+        return int(self.reused.get("recordsCount") or 0)
+
+    def to_entry(self) -> Dict[str, Any]:
+        if self.medals is None:
+            entry = self.reused
+            if self.timing is not None:
+                entry = without_timing(entry)
+        else:
+            entry = build_entry(self.map, self.medals)
+        if self.retried is None and self.timing is None:
+            return entry
+        entry = dict(entry)
+        if self.timing is not None:
+            entry["timing"] = self.timing
+        if self.retried is not None:
+            entry["retried"] = self.retried
+        return entry
+
+
+class SnapshotStore:
+    """SQLite log of every leaderboard a run computed medals from, for offline recomputes.
+
+    `snapshots` has one row per map per fetch (raw times, author time, timestamp);
+    `campaign_maps` remembers which maps a campaign listed, in discovery order, with the
+    TMX fields `MapRecord.from_tmx` reads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS snapshots (
+                uid TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                author_time INTEGER NOT NULL,
+                times TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_uid ON snapshots (uid, fetched_at);
+            CREATE TABLE IF NOT EXISTS campaign_maps (
+                author TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                uid TEXT NOT NULL,
+                map TEXT NOT NULL,
+                PRIMARY KEY (author, prefix, uid)
+            );
+            """
+        )
+
+    def add(self, uid: str, author_time: int, times: List[int], fetched_at: Optional[float] = None) -> None:
+        row = (uid, time.time() if fetched_at is None else fetched_at, int(author_time or 0), json.dumps(times))
+        with self._lock:
+            self._db.execute("INSERT INTO snapshots VALUES (?, ?, ?, ?)", row)
+
+    def record_campaign(self, author: str, prefix: str, maps: List[MapRecord]) -> None:
+        rows = [(author, prefix, i, rec.uid, json.dumps(rec.meta(), ensure_ascii=False)) for i, rec in enumerate(maps)]
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM campaign_maps WHERE author = ? AND prefix = ?", (author, prefix))
+            self._db.executemany("INSERT INTO campaign_maps VALUES (?, ?, ?, ?, ?)", rows)
+
+    def campaign(self, author: str, prefix: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid, map FROM campaign_maps WHERE author = ? AND prefix = ? ORDER BY position", (author, prefix)
+            ).fetchall()
+        return [(uid, json.loads(meta)) for uid, meta in rows]
+
+    def campaigns(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._db.execute("SELECT DISTINCT author, prefix FROM campaign_maps ORDER BY author, prefix").fetchall()
+
+    def latest(self, as_of: Optional[float] = None) -> Dict[str, Tuple[float, int, List[int]]]:
+        """uid -> (fetched_at, author_time, times) of the newest snapshot, optionally no newer than `as_of`."""
+        query = "SELECT uid, MAX(fetched_at), author_time, times FROM snapshots"
+        params: Tuple[Any, ...] = ()
+        if as_of is not None:
+            query += " WHERE fetched_at <= ?"
+            params = (as_of,)
+        with self._lock:
+            rows = self._db.execute(query + " GROUP BY uid", params).fetchall()
+        return {uid: (at_ts, author_time, json.loads(times)) for uid, at_ts, author_time, times in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_SNAPSHOTS: Optional[SnapshotStore] = None
+
+
+def configure_snapshots(path: Optional[str]) -> Optional[SnapshotStore]:
+    global _SNAPSHOTS
+    if _SNAPSHOTS is not None:
+        _SNAPSHOTS.close()
+    _SNAPSHOTS = SnapshotStore(path) if path else None
+    return _SNAPSHOTS
+
+
+def snapshot_store() -> Optional[SnapshotStore]:
+    """The store `configure_snapshots` opened, if any."""
+    return _SNAPSHOTS
+
+
+def snapshot_hook(uid: str) -> Optional[Callable[[int, List[int]], None]]:
+    store = _SNAPSHOTS
+    if store is None:
+        return None
+    return lambda at, times: store.add(uid, at, times)
+
+
+# Where author times come from: "tmx" uses the Medals.Author value fetch_maps already has and
+# asks TMIO only when it is missing or zero; "tmio" always asks TMIO; "verify" is "tmx" plus a
+# batched TMIO cross-check after the run (see verify_author_times)
+AUTHOR_TIME_SOURCE = "tmx"
+AUTHOR_TIME_SOURCES = ("tmx", "tmio", "verify")
+
+
+def configure_author_time(source: str) -> None:
+    global AUTHOR_TIME_SOURCE
+    if source not in AUTHOR_TIME_SOURCES:
+        raise ValueError(f"unknown author time source: {source}")
+    AUTHOR_TIME_SOURCE = source
+
+
+# When set, each entry gets a "timing" block: ms per endpoint, ms asleep, total ms
+RECORD_MAP_TIMINGS = False
+
+
+def configure_map_timings(enabled: bool) -> None:
+    global RECORD_MAP_TIMINGS
+    RECORD_MAP_TIMINGS = bool(enabled)
+
+
+def without_timing(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry minus its per-run "timing" block, for comparisons."""
+    if "timing" not in entry:
+        return entry
+    return {k: v for k, v in entry.items() if k != "timing"}
+
+
+def ordered_map(fn: Callable[[T], R], items: Iterable[T], workers: int) -> Iterator[R]:
+    """Like `map`, but runs `fn` on a bounded thread pool and still yields results in input order.
+
+    At most `2 * workers` items are in flight, so `items` can be a lazy iterator.
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Results with fewer records than this, or without an author time, are retried after the main pass
+SPARSE_RECORDS = 20
+SPARSE_RETRY_ATTEMPTS = 2
+SPARSE_RETRY_DELAY = 1.0
+
+
+def configure_sparse_retries(attempts: int = 2, delay: float = 1.0) -> None:
+    global SPARSE_RETRY_ATTEMPTS, SPARSE_RETRY_DELAY
+    SPARSE_RETRY_ATTEMPTS = max(0, int(attempts))
+    SPARSE_RETRY_DELAY = max(0.0, float(delay))
+
+
+def retry_reason(result: MapResult) -> Optional[str]:
+    """Why a result looks like a transient TMIO glitch worth refetching, or None."""
+    if not result.author_time:
+        return "no_author_time"
+    if result.records_count < SPARSE_RECORDS:
+        return "sparse"
+    return None
+
+
+class _Deferred:
+    __slots__ = ("result", "reason", "attempts")
+
+    def __init__(self, result: MapResult, reason: str):
+        self.result = result
+        self.reason = reason
+        self.attempts = 0
+
+
+class RetryQueue:
+    """Maps whose first result looked sparse, refetched after the main pass instead of inline.
+
+    Each round waits `delay` (doubling per round), then refetches every still-unresolved
+    map concurrently with caches bypassed; a refetch replaces the kept result when it has
+    more records or finally has an author time. Maps stop after `attempts` rounds.
+    """
+
+    def __init__(self, user_agent: str, attempts: int, delay: float, workers: int = 1):
+        self.user_agent = user_agent
+        self.attempts = attempts
+        self.delay = delay
+        self.workers = max(1, workers)
+        self.items: List[_Deferred] = []
+
+    def add(self, result: MapResult, reason: str) -> None:
+        self.items.append(_Deferred(result, reason))
+
+    def _refetch(self, item: _Deferred) -> MapResult:
+        old = item.result
+        uid = old.uid
+        try:
+            medals = compute_map_tmio(uid, self.user_agent, known_author_time=old.author_time, on_result=snapshot_hook(uid), fresh=True)
+        except FetchError:
+            return old
+        if medals.author_time_source is None:
+            medals.author_time_source = old.medals.author_time_source
+        return MapResult(old.map, medals)
+
+    def drain(self, cancel: Optional[threading.Event] = None) -> Iterator[MapResult]:
+        """Run the retry rounds, then yield every queued map's final result with `retried` set."""
+        pending = list(self.items)
+        for attempt in range(1, self.attempts + 1):
+            if not pending or (cancel is not None and cancel.is_set()):
+                break
+            wait = self.delay * 2 ** (attempt - 1)
+            times_net.METRICS.sleep("deferred", "retry_queue", wait)
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+            still = []
+            for item, fresh in zip(pending, ordered_map(self._refetch, pending, self.workers)):
+                item.attempts = attempt
+                old = item.result
+                if fresh.records_count > old.records_count or (not old.author_time and fresh.author_time):
+                    item.result = fresh
+                if retry_reason(item.result) is not None:
+                    still.append(item)
+            pending = still
+        for item in self.items:
+            item.result.retried = {
+                "attempts": item.attempts,
+                "reason": item.reason,
+                "resolved": retry_reason(item.result) is None,
+            }
+            yield item.result
+
+
+class Pipeline:
+    """The per-map core every entry point drives: main, batch, watch's first run and the Tk tool.
+
+    `results` turns TMX search results into `MapResult`s, yielded in input order with up
+    to `workers` maps in flight. Request spacing is left to the per-host limiter in
+    `http_get`, so maps served from the response cache are not slowed down by politeness
+    delays. Setting `cancel` stops new maps from starting; maps already in flight finish
+    and are still yielded.
+
+    Results that look sparse (see `retry_reason`) are yielded as they are and queued on
+    a `RetryQueue`; after the main pass each of them is yielded once more with `retried`
+    set. Consumers keep the last result per UID. `maps` collects the record of every
+    map that was started, in discovery order. Maps that could not be computed because a
+    host's circuit was open are not yielded; `missing` maps their UID to the reason.
+    """
+
+    def __init__(
+        self,
+        user_agent: str,
+        workers: int = 1,
+        previous: Optional[Dict[str, Dict[str, Any]]] = None,
+        cancel: Optional[threading.Event] = None,
+    ):
+        self.user_agent = user_agent
+        self.workers = max(1, workers)
+        self.previous = previous or {}
+        self.cancel = cancel
+        self.maps: List[MapRecord] = []
+        self.missing: Dict[str, str] = {}
+
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def process(self, rec: MapRecord) -> MapResult:
+        """Compute one map.
+
+        For maps in `previous` the stored author time is reused, and when the fresh
+        leaderboard hashes the same the old entry is reused unchanged.
+        """
+        if not RECORD_MAP_TIMINGS:
+            return self._process(rec)
+        with map_timer() as acc:
+            result = self._process(rec)
+        result.timing = {k: round(v * 1000, 1) for k, v in sorted(acc.items())}
+        return result
+
+    def _process(self, rec: MapRecord) -> MapResult:
+        uid = rec.uid
+        on_result = snapshot_hook(uid)
+        prev = self.previous.get(uid)
+        tmx_at = rec.tmx_author_time if AUTHOR_TIME_SOURCE != "tmio" else 0
+        if prev is None:
+            medals = self._medals(rec, tmx_at, None, on_result)
+            if medals.author_time_source is None:
+                medals.author_time_source = "tmx"
+            return MapResult(rec, medals)
+        prev_at = int(prev.get("authorTime_ms") or 0)
+        board = Leaderboard.fetch(uid, self.user_agent)
+        if (
+            prev_at > 0
+            and board.times
+            and prev.get("leaderboardHash") == board.hash
+            and (prev.get("computed") or {}).get("settings") == leaderboard_settings()
+        ):
+            if on_result is not None:
+                on_result(prev_at, board.times)
+            return MapResult(rec, reused=prev)
+        known, label = (prev_at, (prev.get("source") or {}).get("author_time") or "tmio") if prev_at > 0 else (tmx_at, "tmx")
+        medals = self._medals(rec, known, board, on_result)
+        if medals.author_time_source is None:
+            medals.author_time_source = label
+        return MapResult(rec, medals)
+
+    def _medals(
+        self,
+        rec: MapRecord,
+        known: int,
+        board: Optional[Leaderboard],
+        on_result: Optional[Callable[[int, List[int]], None]],
+    ) -> MedalResult:
+        if HEDGE_AFTER is None or rec.track_id is None:
+            return compute_map_tmio(rec.uid, self.user_agent, known_author_time=known, board=board, on_result=on_result)
+        return hedged_medals(rec, self.user_agent, known, board, on_result)
+
+    def results(self, maps: Iterable[Dict[str, Any]]) -> Iterator[MapResult]:
+        retries = RetryQueue(self.user_agent, SPARSE_RETRY_ATTEMPTS, SPARSE_RETRY_DELAY, self.workers)
+
+        def pending() -> Iterator[MapRecord]:
+            for m in maps:
+                if self.cancelled():
+                    return
+                rec = MapRecord.from_tmx(m)
+                if rec is not None:
+                    self.maps.append(rec)
+                    yield rec
+
+        def work(rec: MapRecord) -> Optional[MapResult]:
+            if self.cancelled():
+                return None
+            try:
+                return self.process(rec)
+            except FetchError as e:
+                self.missing[rec.uid] = str(e)
+                return None
+
+        for result in ordered_map(work, pending(), self.workers):
+            if result is None:
+                continue
+            reason = retry_reason(result) if retries.attempts else None
+            # A reused entry means TMIO served the same board as last time; nothing to retry
+            if reason is not None and result.medals is not None:
+                retries.add(result, reason)
+            yield result
+        if not self.cancelled():
+            yield from retries.drain(self.cancel)
+
+    def entries(self, maps: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """`results`, serialized to output entries as each one is yielded."""
+        for result in self.results(maps):
+            yield result.to_entry()
+
+    def missing_maps(self) -> List[Dict[str, Any]]:
+        """The maps left out of the output, in discovery order, for the document's "missing" list."""
+        return [
+            {"uid": rec.uid, "trackId": rec.track_id, "name": rec.name, "reason": self.missing[rec.uid]}
+            for rec in self.maps
+            if rec.uid in self.missing
+        ]
+
+
+def merge_entries(entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collect `Pipeline.entries` output, letting a later entry for a UID replace the earlier one in place."""
+    out: List[Dict[str, Any]] = []
+    index: Dict[Any, int] = {}
+    for entry in entries:
+        uid = entry.get("uid")
+        if uid in index:
+            out[index[uid]] = entry
+        else:
+            index[uid] = len(out)
+            out.append(entry)
+    return out
+
+
+def verify_author_times(entries: List[Dict[str, Any]], user_agent: str, workers: int = 1) -> List[str]:
+    """Cross-check TMX-sourced author times against TMIO in one pass after the run.
+
+    Mismatching entries are recomputed in place with the TMIO value (TMIO stays the
+    authority), which refetches their leaderboard; returns one report line per mismatch.
+    """
+    todo = [i for i, e in enumerate(entries) if (e.get("source") or {}).get("author_time") == "tmx"]
+    def check(i: int) -> Optional[int]:
+        try:
+            return fetch_tmio_author_time(entries[i]["uid"], user_agent)
+        except FetchError:
+            return None
+
+    tmio_ats = list(ordered_map(check, todo, max(1, workers)))
+    lines: List[str] = []
+    mismatched = []
+    for i, at in zip(todo, tmio_ats):
+        e = entries[i]
+        if at and at != e.get("authorTime_ms"):
+            lines.append(f"  ! {e.get('name')} ({e['uid']}): TMX author time {e.get('authorTime_ms')} != TMIO {at}")
+            mismatched.append((i, at))
+
+    def redo(item: Tuple[int, int]) -> Dict[str, Any]:
+        i, at = item
+        e = entries[i]
+        try:
+            medals = compute_map_tmio(e["uid"], user_agent, known_author_time=at)
+        except FetchError:
+            return e
+        medals.author_time_source = "tmio"
+        return build_entry(MapRecord.from_entry(e), medals)
+
+    for (i, _), fixed in zip(mismatched, ordered_map(redo, mismatched, max(1, workers))):
+        entries[i] = fixed
+    lines.insert(0, f"Verify: {len(todo)} TMX author time(s) checked against TMIO, {len(mismatched)} mismatch(es)")
+    return lines
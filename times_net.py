@@ -0,0 +1,1250 @@
+import functools
+import hashlib
+import itertools
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+import time
+
+T = TypeVar("T")
+
+# API roots; overridden by the offline benchmark to point at a local stand-in server.
+TMX_BASE = "https://trackmania.exchange"
+TMIO_BASE = "https://trackmania.io"
+
+
+class _Bucket:
+    __slots__ = ("tokens", "stamp", "rate", "blocked_until", "streak")
+
+    def __init__(self, rate: float):
+        self.tokens = 1.0
+        self.stamp = time.monotonic()
+        self.rate = rate
+        self.blocked_until = 0.0
+        self.streak = 0
+
+
+class HostRateLimiter:
+    """Per-host token buckets shared by every fetch function and worker.
+
+    Each host starts at `rate` requests/s (bursts of up to `burst`). A 429 cuts that
+    host's rate by 30% (down to `min_rate`) and, when the server sent Retry-After, holds
+    every request to the host until it has passed; each run of `recover_after` successes
+    adds back 10% of `rate`, never exceeding it. A `rate` of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float = 6.0, burst: float = 2.0, min_rate: float = 0.25, recover_after: int = 5):
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.min_rate = min(min_rate, self.rate) if self.rate > 0 else 0.0
+        self.recover_after = max(1, int(recover_after))
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, _Bucket] = {}
+
+    def _bucket(self, host: str) -> _Bucket:
+        b = self._buckets.get(host)
+        if b is None:
+            b = _Bucket(self.rate)
+            self._buckets[host] = b
+        return b
+
+    def acquire(self, url: str) -> float:
+        """Block until a request to `url`'s host may start; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        host = urlsplit(url).netloc
+        waited = 0.0
+        while True:
+            with self._lock:
+                b = self._bucket(host)
+                now = time.monotonic()
+                b.tokens = min(self.burst, b.tokens + (now - b.stamp) * b.rate)
+                b.stamp = now
+                if now < b.blocked_until:
+                    delay = b.blocked_until - now
+                elif b.tokens >= 1.0:
+                    b.tokens -= 1.0
+                    return waited
+                else:
+                    delay = (1.0 - b.tokens) / b.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self, url: str) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            b = self._bucket(urlsplit(url).netloc)
+            b.streak += 1
+            if b.streak >= self.recover_after and b.rate < self.rate:
+                b.rate = min(self.rate, b.rate + 0.1 * self.rate)
+                b.streak = 0
+
+    def on_throttle(self, url: str, retry_after: Optional[float] = None) -> None:
+        if self.rate <= 0:
+            time.sleep(min(30.0, retry_after if retry_after is not None else 1.0))
+            return
+        with self._lock:
+            b = self._bucket(urlsplit(url).netloc)
+            b.rate = max(self.min_rate, b.rate * 0.7)
+            b.streak = 0
+            b.tokens = min(b.tokens, 0.0)
+            if retry_after:
+                b.blocked_until = max(b.blocked_until, time.monotonic() + min(30.0, retry_after))
+
+    def rates(self) -> Dict[str, float]:
+        with self._lock:
+            return {host: round(b.rate, 3) for host, b in self._buckets.items()}
+
+
+_LIMITER = HostRateLimiter()
+RETRY_ATTEMPTS = 4
+
+
+def configure_limiter(rate: float = 6.0, burst: float = 2.0, attempts: int = 4) -> HostRateLimiter:
+    """Replace the shared per-host limiter and set the per-request attempt budget."""
+    global _LIMITER, RETRY_ATTEMPTS
+    _LIMITER = HostRateLimiter(rate, burst)
+    RETRY_ATTEMPTS = max(1, int(attempts))
+    return _LIMITER
+
+
+class FetchError(RuntimeError):
+    """A map's data could not be fetched, so it is left missing rather than written empty."""
+
+
+class CircuitOpenError(FetchError):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+
+class _Circuit:
+    __slots__ = ("state", "outcomes", "opened_at", "probing")
+
+    def __init__(self, window: int):
+        self.state = "closed"
+        self.outcomes: deque = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probing = False
+
+
+class CircuitBreaker:
+    """Per-host circuit breakers in front of every request, so an outage fails fast.
+
+    A host's circuit opens once at least `min_calls` of its last `window` attempts are
+    known and `threshold` of them failed (network errors and 5xx; any other response
+    means the host is up). While open, requests raise CircuitOpenError without being
+    sent. After `cooldown` seconds the circuit goes half-open and lets exactly one probe
+    through: success closes it, failure opens it for another cooldown. A `threshold`
+    of 0 disables the breaker.
+    """
+
+    def __init__(self, threshold: float = 0.5, cooldown: float = 30.0, window: int = 20, min_calls: int = 8):
+        self.threshold = max(0.0, float(threshold))
+        self.cooldown = max(0.0, float(cooldown))
+        self.window = max(1, int(window))
+        self.min_calls = max(1, min(int(min_calls), self.window))
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def _circuit(self, host: str) -> _Circuit:
+        c = self._circuits.get(host)
+        if c is None:
+            c = _Circuit(self.window)
+            self._circuits[host] = c
+        return c
+
+    def before(self, url: str) -> None:
+        """Raise CircuitOpenError unless a request to `url`'s host may be sent now."""
+        if self.threshold <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            c = self._circuit(host)
+            if c.state == "closed":
+                return
+            if c.state == "open" and time.monotonic() - c.opened_at >= self.cooldown:
+                c.state = "half-open"
+            if c.state == "half-open" and not c.probing:
+                c.probing = True
+                return
+        raise CircuitOpenError(f"circuit open for {host}")
+
+    def record(self, url: str, ok: bool) -> None:
+        if self.threshold <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            c = self._circuit(host)
+            if c.state != "closed":
+                if not c.probing:
+                    # A request sent before the circuit opened; only the probe decides
+                    return
+                c.probing = False
+                if ok:
+                    c.state = "closed"
+                    c.outcomes.clear()
+                    print(f"Circuit closed for {host}: probe succeeded", file=sys.stderr)
+                else:
+                    c.state = "open"
+                    c.opened_at = time.monotonic()
+                return
+            c.outcomes.append(ok)
+            failed = c.outcomes.count(False)
+            if len(c.outcomes) >= self.min_calls and failed >= self.threshold * len(c.outcomes):
+                c.state = "open"
+                c.opened_at = time.monotonic()
+                print(
+                    f"Circuit open for {host}: {failed}/{len(c.outcomes)} recent requests failed, "
+                    f"failing fast for {self.cooldown:g}s",
+                    file=sys.stderr,
+                )
+
+    def states(self) -> Dict[str, str]:
+        with self._lock:
+            return {host: c.state for host, c in self._circuits.items()}
+
+
+_BREAKER = CircuitBreaker()
+
+
+def configure_breaker(threshold: float = 0.5, cooldown: float = 30.0) -> CircuitBreaker:
+    global _BREAKER
+    _BREAKER = CircuitBreaker(threshold, cooldown)
+    return _BREAKER
+
+
+def _retry_after_seconds(r: requests.Response) -> Optional[float]:
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return 1.0
+
+
+def _backoff(attempt: int) -> float:
+    return min(5.0, 0.5 * (2 ** attempt))
+
+
+class HttpPool:
+    """Keep-alive HTTP layer shared by every fetch function.
+
+    Each thread gets its own `requests.Session` (sessions are not thread-safe), but all
+    of them mount the same `HTTPAdapter`, so TCP/TLS connections are pooled per host and
+    reused across threads.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10):
+        self.pool_connections = max(1, int(pool_connections))
+        self.pool_maxsize = max(1, int(pool_maxsize))
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            s.mount("https://", self._adapter)
+            s.mount("http://", self._adapter)
+            self._local.session = s
+        return s
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        with self._lock:
+            self._requests += 1
+        return self.session().request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Requests sent, connections opened and how many requests reused a pooled connection."""
+        opened = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += getattr(pool, "num_connections", 0)
+        with self._lock:
+            sent = self._requests
+        reused = max(0, sent - opened)
+        return {
+            "requests": sent,
+            "connections": opened,
+            "reused": reused,
+            "reuse_ratio": round(reused / sent, 3) if sent else 0.0,
+        }
+
+    def close(self) -> None:
+        self._adapter.close()
+
+
+_POOL = HttpPool()
+
+
+def configure_pool(pool_connections: int = 10, pool_maxsize: int = 10) -> HttpPool:
+    """Replace the shared pool, e.g. to size it for the number of workers."""
+    global _POOL
+    _POOL.close()
+    _POOL = HttpPool(pool_connections, pool_maxsize)
+    return _POOL
+
+
+def pool_stats() -> Dict[str, Any]:
+    return _POOL.stats()
+
+
+# Freshness per endpoint, first matching URL path fragment wins. Leaderboards move,
+# map metadata (author time) practically never does.
+CACHE_TTLS: List[Tuple[str, float]] = [
+    ("/api/leaderboard/", 10 * 60),
+    ("/api/map/", 7 * 24 * 3600),
+    ("/api/replays", 60 * 60),
+    ("/api/maps", 60 * 60),
+    ("/mapsearch2/", 60 * 60),
+]
+DEFAULT_CACHE_TTL = 10 * 60
+
+# Read once: os.umask can only be queried by setting it, which is not thread-safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def replace_file(path: str, write: Callable[[IO[str]], None]) -> None:
+    """Write a text file through `write` into a temp file next to `path`, then rename it over `path`.
+
+    Readers never see a half-written file. The result keeps the mode of the file it
+    replaces (new files get 0666 minus the umask, as with `open`), and the temp file is
+    removed if writing fails.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ResponseCache:
+    """On-disk JSON response cache keyed by URL + params.
+
+    Entries past their TTL are revalidated with If-None-Match / If-Modified-Since when
+    the server sent an ETag or Last-Modified; the directory is kept under `max_bytes`
+    by evicting the least recently written entries.
+    """
+
+    def __init__(self, directory: str, max_age: Optional[float] = None, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._files())
+
+    @staticmethod
+    def key(url: str, params: Dict[str, Any]) -> str:
+        raw = url + "?" + json.dumps({str(k): str(v) for k, v in params.items()}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def ttl_for(self, url: str) -> float:
+        if self.max_age is not None:
+            return self.max_age
+        path = urlsplit(url).path
+        for fragment, ttl in CACHE_TTLS:
+            if fragment in path:
+                return ttl
+        return DEFAULT_CACHE_TTL
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _files(self) -> List[Tuple[str, int, float]]:
+        found: List[Tuple[str, int, float]] = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                if f.name.endswith(".json"):
+                    st = f.stat()
+                    found.append((f.path, st.st_size, st.st_mtime))
+        return found
+
+    def lookup(self, url: str, params: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Return (record, is_fresh); record is None on a miss or unreadable entry."""
+        path = self._path(self.key(url, params))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None, False
+        age = time.time() - float(record.get("stored_at") or 0)
+        return record, age <= self.ttl_for(url)
+
+    def store(self, url: str, params: Dict[str, Any], body: Any, etag: Optional[str], last_modified: Optional[str]) -> None:
+        path = self._path(self.key(url, params))
+        record = {
+            "url": url,
+            "params": params,
+            "stored_at": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        replace_file(path, lambda f: json.dump(record, f, ensure_ascii=False))
+        with self._lock:
+            self._size += os.path.getsize(path) - old_size
+            over = self.max_bytes and self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def refresh(self, url: str, params: Dict[str, Any], record: Dict[str, Any]) -> None:
+        """Mark a revalidated (304) entry as fresh again."""
+        self.store(url, params, record.get("body"), record.get("etag"), record.get("last_modified"))
+
+    def evict(self) -> None:
+        """Drop the oldest entries until the cache is back under 90% of `max_bytes`."""
+        with self._lock:
+            files = sorted(self._files(), key=lambda f: f[2])
+            total = sum(size for _, size, _ in files)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    continue
+            self._size = total
+
+
+_CACHE: Optional[ResponseCache] = None
+
+
+def configure_cache(directory: Optional[str], max_age: Optional[float] = None, max_mb: float = 256) -> Optional[ResponseCache]:
+    """Enable the on-disk response cache for all fetches (None disables it)."""
+    global _CACHE
+    _CACHE = ResponseCache(directory, max_age, int(max_mb * 1024 * 1024)) if directory else None
+    return _CACHE
+
+
+# Endpoint labels for metrics, first matching URL path fragment wins
+ENDPOINTS: List[Tuple[str, str]] = [
+    ("/api/leaderboard/", "tmio_leaderboard"),
+    ("/api/map/", "tmio_map"),
+    ("/api/replays/get_replays/", "tmx_replays_legacy"),
+    ("/api/replays", "tmx_replays"),
+    ("/api/maps", "tmx_search"),
+    ("/mapsearch2/", "tmx_legacy_search"),
+    (".json", "firebase"),
+]
+LATENCY_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def endpoint_of(url: str) -> str:
+    path = urlsplit(url).path
+    for fragment, name in ENDPOINTS:
+        if fragment in path:
+            return name
+    return "other"
+
+
+class _EndpointStats:
+    __slots__ = ("requests", "retries", "throttled", "errors", "short_circuited", "bytes", "latency_sum", "buckets", "sleep", "cache")
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.short_circuited = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sleep: Dict[str, float] = {}
+        self.cache: Dict[str, int] = {}
+
+
+class Metrics:
+    """Per-endpoint request instrumentation: latency histogram, retries, 429s, bytes,
+    time spent sleeping (limiter waits and retry backoff) and response-cache results,
+    plus hedged-fetch outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _EndpointStats] = {}
+        self.hedges: Dict[str, int] = {}
+        self.started = time.time()
+
+    def _get(self, endpoint: str) -> _EndpointStats:
+        st = self._stats.get(endpoint)
+        if st is None:
+            st = _EndpointStats()
+            self._stats[endpoint] = st
+        return st
+
+    def request(self, endpoint: str, seconds: float, status: Optional[int], nbytes: int) -> None:
+        with self._lock:
+            st = self._get(endpoint)
+            st.requests += 1
+            st.latency_sum += seconds
+            st.bytes += nbytes
+            i = 0
+            while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+                i += 1
+            st.buckets[i] += 1
+            if status == 429:
+                st.throttled += 1
+            elif status is None or status >= 500:
+                st.errors += 1
+        _timing_add(endpoint, seconds)
+
+    def retry(self, endpoint: str) -> None:
+        with self._lock:
+            self._get(endpoint).retries += 1
+
+    def short_circuit(self, endpoint: str) -> None:
+        with self._lock:
+            self._get(endpoint).short_circuited += 1
+
+    def sleep(self, endpoint: str, kind: str, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        with self._lock:
+            st = self._get(endpoint)
+            st.sleep[kind] = st.sleep.get(kind, 0.0) + seconds
+        _timing_add("sleep", seconds)
+
+    def cache(self, endpoint: str, result: str) -> None:
+        with self._lock:
+            st = self._get(endpoint)
+            st.cache[result] = st.cache.get(result, 0) + 1
+
+    def hedge(self, outcome: str) -> None:
+        with self._lock:
+            self.hedges[outcome] = self.hedges.get(outcome, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = {}
+            for name, st in sorted(self._stats.items()):
+                cumulative = []
+                total = 0
+                for bound, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], st.buckets):
+                    total += n
+                    cumulative.append([bound, total])
+                endpoints[name] = {
+                    "requests": st.requests,
+                    "retries": st.retries,
+                    "throttled_429": st.throttled,
+                    "errors": st.errors,
+                    "short_circuited": st.short_circuited,
+                    "bytes_received": st.bytes,
+                    "latency_sum_s": round(st.latency_sum, 6),
+                    "latency_mean_ms": round(1000 * st.latency_sum / st.requests, 2) if st.requests else None,
+                    "latency_buckets_s": cumulative,
+                    "sleep_s": {k: round(v, 6) for k, v in sorted(st.sleep.items())},
+                    "cache": dict(sorted(st.cache.items())),
+                }
+            hedges = dict(sorted(self.hedges.items()))
+        return {
+            "started_at": self.started,
+            "elapsed_s": round(time.time() - self.started, 3),
+            "endpoints": endpoints,
+            "hedges": hedges,
+        }
+
+    def prometheus(self, prefix: str = "generate_times") -> str:
+        """Render the counters in the Prometheus text exposition format."""
+        full = self.snapshot()
+        snap = full["endpoints"]
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        family("http_requests_total", "counter", "HTTP requests sent, per endpoint.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_requests_total{{endpoint="{ep}"}} {st["requests"]}')
+        family("http_retries_total", "counter", "Request attempts that were retried.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_retries_total{{endpoint="{ep}"}} {st["retries"]}')
+        family("http_throttled_total", "counter", "Responses with status 429.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_throttled_total{{endpoint="{ep}"}} {st["throttled_429"]}')
+        family("http_errors_total", "counter", "Network errors and 5xx responses.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_errors_total{{endpoint="{ep}"}} {st["errors"]}')
+        family("http_short_circuited_total", "counter", "Requests failed fast by an open circuit breaker.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_short_circuited_total{{endpoint="{ep}"}} {st["short_circuited"]}')
+        family("http_response_bytes_total", "counter", "Response body bytes received.")
+        for ep, st in snap.items():
+            lines.append(f'{prefix}_http_response_bytes_total{{endpoint="{ep}"}} {st["bytes_received"]}')
+        family("http_request_duration_seconds", "histogram", "HTTP request latency.")
+        for ep, st in snap.items():
+            for bound, count in st["latency_buckets_s"]:
+                lines.append(f'{prefix}_http_request_duration_seconds_bucket{{endpoint="{ep}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_http_request_duration_seconds_sum{{endpoint="{ep}"}} {st["latency_sum_s"]}')
+            lines.append(f'{prefix}_http_request_duration_seconds_count{{endpoint="{ep}"}} {st["requests"]}')
+        family("sleep_seconds_total", "counter", "Time spent waiting on the rate limiter or retry backoff.")
+        for ep, st in snap.items():
+            for kind, secs in st["sleep_s"].items():
+                lines.append(f'{prefix}_sleep_seconds_total{{endpoint="{ep}",kind="{kind}"}} {secs}')
+        family("cache_lookups_total", "counter", "Response cache lookups by result.")
+        for ep, st in snap.items():
+            for result, n in st["cache"].items():
+                lines.append(f'{prefix}_cache_lookups_total{{endpoint="{ep}",result="{result}"}} {n}')
+        family("hedges_total", "counter", "Hedged leaderboard fetches by outcome.")
+        for outcome, n in full["hedges"].items():
+            lines.append(f'{prefix}_hedges_total{{outcome="{outcome}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+REQUEST_TIMING = threading.local()
+
+
+def reset_metrics() -> Metrics:
+    global METRICS
+    METRICS = Metrics()
+    return METRICS
+
+
+def _timing_add(key: str, seconds: float) -> None:
+    acc = getattr(REQUEST_TIMING, "acc", None)
+    if acc is not None:
+        acc[key] = acc.get(key, 0.0) + seconds
+
+
+class map_timer:
+    """Collect per-endpoint request and sleep time on this thread while one map is processed."""
+
+    def __enter__(self) -> Dict[str, float]:
+        self.acc: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        REQUEST_TIMING.acc = self.acc
+        return self.acc
+
+    def __exit__(self, *exc: Any) -> None:
+        REQUEST_TIMING.acc = None
+        self.acc["total"] = time.perf_counter() - self.started
+
+
+def _timed_request(endpoint: str, method: str, url: str, **kwargs: Any) -> requests.Response:
+    """Send one attempt through the circuit breaker, recording its metrics and outcome."""
+    try:
+        _BREAKER.before(url)
+    except CircuitOpenError:
+        METRICS.short_circuit(endpoint)
+        raise
+    t0 = time.perf_counter()
+    try:
+        r = _POOL.request(method, url, **kwargs)
+    except Exception:
+        METRICS.request(endpoint, time.perf_counter() - t0, None, 0)
+        _BREAKER.record(url, False)
+        raise
+    METRICS.request(endpoint, time.perf_counter() - t0, r.status_code, len(r.content or b""))
+    _BREAKER.record(url, r.status_code < 500)
+    return r
+
+
+def _on_throttle(endpoint: str, url: str, r: requests.Response) -> None:
+    t0 = time.perf_counter()
+    _LIMITER.on_throttle(url, _retry_after_seconds(r))
+    METRICS.sleep(endpoint, "throttle", time.perf_counter() - t0)
+
+
+def _sleep_backoff(endpoint: str, attempt: int) -> None:
+    delay = _backoff(attempt)
+    METRICS.sleep(endpoint, "backoff", delay)
+    time.sleep(delay)
+
+
+def http_get(
+    url: str,
+    params: Dict[str, Any],
+    user_agent: str,
+    accept: Optional[Callable[[Any], bool]] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """GET a JSON document, served from the response cache when it is enabled and fresh.
+
+    Every attempt waits on the shared per-host limiter. Network errors, 429, 5xx and
+    payloads rejected by `accept` (e.g. a transiently empty leaderboard) all draw from
+    the same budget of RETRY_ATTEMPTS; when only `accept` keeps failing, the last
+    payload is returned instead of raising. An open circuit (see CircuitBreaker) raises
+    CircuitOpenError at once, without retrying. Only accepted payloads are cached.
+    `use_cache=False` skips the cache lookup but still stores the new response.
+    """
+    headers = {"User-Agent": user_agent}
+    endpoint = endpoint_of(url)
+    cache = _CACHE
+    cached: Optional[Dict[str, Any]] = None
+    if cache is not None and use_cache:
+        cached, fresh = cache.lookup(url, params)
+        if cached is not None and fresh:
+            METRICS.cache(endpoint, "hit")
+            return cached["body"]
+        METRICS.cache(endpoint, "stale" if cached is not None else "miss")
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+    attempts = RETRY_ATTEMPTS
+    last_exc: Optional[Exception] = None
+    rejected: Any = None
+    have_rejected = False
+    for attempt in range(attempts):
+        if attempt > 0:
+            METRICS.retry(endpoint)
+        try:
+            METRICS.sleep(endpoint, "limiter", _LIMITER.acquire(url))
+            r = _timed_request(endpoint, "GET", url, params=params, headers=headers, timeout=30)
+            if r.status_code == 304 and cached is not None:
+                _LIMITER.on_success(url)
+                METRICS.cache(endpoint, "revalidated")
+                cache.refresh(url, params, cached)
+                return cached["body"]
+            if r.status_code == 429:
+                _on_throttle(endpoint, url, r)
+                last_exc = requests.HTTPError("429")
+                continue
+            if 500 <= r.status_code < 600:
+                raise requests.HTTPError(f"{r.status_code}")
+            r.raise_for_status()
+            data = r.json()
+            _LIMITER.on_success(url)
+            if accept is not None and not accept(data):
+                rejected, have_rejected = data, True
+            else:
+                if cache is not None:
+                    cache.store(url, params, data, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+                return data
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            last_exc = e
+        if attempt < attempts - 1:
+            _sleep_backoff(endpoint, attempt)
+    if have_rejected:
+        return rejected
+    raise last_exc if last_exc else RuntimeError("http_get failed")
+
+
+def http_send(
+    method: str,
+    url: str,
+    user_agent: str,
+    params: Optional[Dict[str, Any]] = None,
+    payload: Any = None,
+) -> Any:
+    """Uncached JSON request (GET/PUT/PATCH) under the same limiter and retry budget as `http_get`."""
+    headers = {"User-Agent": user_agent}
+    endpoint = endpoint_of(url)
+    attempts = RETRY_ATTEMPTS
+    last_exc: Optional[Exception] = None
+    for attempt in range(attempts):
+        if attempt > 0:
+            METRICS.retry(endpoint)
+        try:
+            METRICS.sleep(endpoint, "limiter", _LIMITER.acquire(url))
+            r = _timed_request(endpoint, method, url, params=params, json=payload, headers=headers, timeout=30)
+            if r.status_code == 429:
+                _on_throttle(endpoint, url, r)
+                last_exc = requests.HTTPError("429")
+                continue
+            if 500 <= r.status_code < 600:
+                raise requests.HTTPError(f"{r.status_code}")
+            r.raise_for_status()
+            _LIMITER.on_success(url)
+            return r.json() if r.content else None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            last_exc = e
+        if attempt < attempts - 1:
+            _sleep_backoff(endpoint, attempt)
+    raise last_exc if last_exc else RuntimeError("http_send failed")
+
+
+def _matches_v2(m: Dict[str, Any], auth_lower: str, pfx: str) -> bool:
+    """Client-side strict filter for /api/maps results: name prefix and uploader/author."""
+    name_val = m.get("Name") or m.get("TrackName") or ""
+    uploader = m.get("Uploader") or {}
+    username_val = m.get("Username") or uploader.get("Name") or ""
+    authors_arr = m.get("Authors") or []
+    has_author_match = username_val.lower() == auth_lower
+    if not has_author_match:
+        for a in authors_arr:
+            auser = a.get("User") if isinstance(a, dict) else None
+            aname = (auser or {}).get("Name") if isinstance(auser, dict) else a.get("Name")
+            if isinstance(aname, str) and aname.lower() == auth_lower:
+                has_author_match = True
+                break
+    if not name_val:
+        return False
+    if not name_val.lower().startswith(pfx):
+        return False
+    return has_author_match
+
+
+def _search_v2(author: str, prefix: str, user_agent: str, per_page: int, cancel: threading.Event) -> Iterator[Dict[str, Any]]:
+    """TMX v2 /api/maps with cursor pagination (after), filtered client-side page by page."""
+    url = f"{TMX_BASE}/api/maps"
+    # Use explicit nested paths for required fields per API docs
+    fields = (
+        "MapId,MapUid,Name,Uploader.Name,Medals.Author,ReplayCount"
+    )
+    pfx = prefix.lower()
+    auth_lower = author.lower()
+    after: Optional[int] = None
+    while not cancel.is_set():
+        params: Dict[str, Any] = {
+            "fields": fields,
+            "name": prefix,
+            "count": str(per_page),
+        }
+        if after is not None:
+            params["after"] = str(after)
+        data = http_get(url, params, user_agent)
+        results = data.get("Results") or data.get("results") or []
+        if not isinstance(results, list) or len(results) == 0:
+            break
+        for m in results:
+            if _matches_v2(m, auth_lower, pfx):
+                yield m
+        # Prepare next cursor
+        last = results[-1].get("MapId") or results[-1].get("TrackId")
+        if last is None:
+            break
+        try:
+            after = int(last)
+        except (TypeError, ValueError):
+            break
+        if data.get("More") is False:
+            break
+
+
+def _search_legacy(
+    author: str,
+    prefix: str,
+    user_agent: str,
+    per_page: int,
+    cancel: threading.Event,
+    name_key: str,
+    size_key: str,
+) -> Iterator[Dict[str, Any]]:
+    """Legacy mapsearch2 search with one name parameter (`name_key`) and page-size parameter (`size_key`)."""
+    legacy_url = f"{TMX_BASE}/mapsearch2/search"
+    pfx = prefix.lower()
+    auth_lower = author.lower()
+    matched = 0
+    page = 1
+    while not cancel.is_set():
+        params = {
+            "api": "on",
+            "author": author,
+            name_key: prefix,
+            "page": str(page),
+            size_key: str(per_page),
+        }
+        data = http_get(legacy_url, params, user_agent)
+        results = data.get("results", [])
+        if not results:
+            break
+        for m in results:
+            name_val = m.get("Name", "")
+            username_val = m.get("Username", "")
+            if not name_val or not username_val:
+                continue
+            if not name_val.lower().startswith(pfx):
+                continue
+            if username_val.lower() != auth_lower:
+                continue
+            matched += 1
+            yield m
+        page += 1
+        total = data.get("totalItemCount")
+        if isinstance(total, int) and matched >= total:
+            break
+
+
+# Map search strategies in their historical order of preference: v2 first, then the
+# legacy mapsearch2 name keys with `length`, then the same with `count`.
+SEARCH_STRATEGIES: Dict[str, Callable[..., Iterator[Dict[str, Any]]]] = {"v2": _search_v2}
+for _size_key in ("length", "count"):
+    for _name_key in ("name", "mapname", "trackname"):
+        SEARCH_STRATEGIES[f"legacy-{_size_key}-{_name_key}"] = functools.partial(
+            _search_legacy, name_key=_name_key, size_key=_size_key
+        )
+
+
+class StrategyMemo:
+    """Remembers which search strategy found maps per (author, prefix), optionally persisted as JSON."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    self._data = {str(k): str(v) for k, v in loaded.items()}
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def key(author: str, prefix: str) -> str:
+        return f"{author.lower()}\t{prefix.lower()}"
+
+    def get(self, author: str, prefix: str) -> Optional[str]:
+        with self._lock:
+            name = self._data.get(self.key(author, prefix))
+        return name if name in SEARCH_STRATEGIES else None
+
+    def remember(self, author: str, prefix: str, strategy: str) -> None:
+        with self._lock:
+            if self._data.get(self.key(author, prefix)) == strategy:
+                return
+            self._data[self.key(author, prefix)] = strategy
+            if not self.path:
+                return
+            replace_file(self.path, lambda f: json.dump(self._data, f, indent=2))
+
+
+_STRATEGY_MEMO = StrategyMemo()
+
+
+def configure_strategy_memo(path: Optional[str]) -> StrategyMemo:
+    """Persist the search-strategy memo to `path` (None keeps it in memory only)."""
+    global _STRATEGY_MEMO
+    _STRATEGY_MEMO = StrategyMemo(path)
+    return _STRATEGY_MEMO
+
+
+class SingleFlightMemo:
+    """In-process memo shared by concurrent jobs: callers asking for the same key while it
+    is loading wait for that one load instead of issuing their own request. Empty results
+    are not remembered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Any, Any] = {}
+        self._inflight: Dict[Any, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, loader: Callable[[], T]) -> T:
+        while True:
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    return self._values[key]
+                ev = self._inflight.get(key)
+                if ev is None:
+                    ev = threading.Event()
+                    self._inflight[key] = ev
+                    self.misses += 1
+                    break
+            ev.wait()
+            with self._lock:
+                if key not in self._values:
+                    # The owner's load came back empty or failed; load it ourselves
+                    self.misses += 1
+                    return loader()
+        try:
+            value = loader()
+            if value:
+                with self._lock:
+                    self._values[key] = value
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            ev.set()
+
+
+_SHARED_MEMO: Optional[SingleFlightMemo] = None
+
+
+def configure_shared_memo(enabled: bool) -> Optional[SingleFlightMemo]:
+    """Share map searches and TMIO results in-process (used by batch mode)."""
+    global _SHARED_MEMO
+    _SHARED_MEMO = SingleFlightMemo() if enabled else None
+    return _SHARED_MEMO
+
+
+def _race_strategies(
+    names: List[str], author: str, prefix: str, user_agent: str, per_page: int, limit: Optional[int]
+) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """Run strategies concurrently; return the first non-empty result and cancel the rest."""
+    if not names:
+        return None, []
+    cancel = threading.Event()
+
+    def collect(name: str) -> List[Dict[str, Any]]:
+        return list(itertools.islice(SEARCH_STRATEGIES[name](author, prefix, user_agent, per_page, cancel), limit))
+
+    pool = ThreadPoolExecutor(max_workers=len(names))
+    futures = {pool.submit(collect, n): n for n in names}
+    try:
+        for fut in as_completed(futures):
+            try:
+                found = fut.result()
+            except Exception:
+                continue
+            if found and not cancel.is_set():
+                cancel.set()
+                return futures[fut], found
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+    return None, []
+
+
+def fetch_maps(
+    author: str,
+    prefix: str,
+    user_agent: str,
+    count: Optional[int] = None,
+    on_cut: Optional[Callable[[int], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield the author's maps whose name starts with `prefix`, at most `count` (None or 0: all).
+
+    Search pages are filtered as they arrive and paging stops once `count` maps were
+    yielded, so callers can start on the first maps while the search is still running.
+    The strategy that last worked for this (author, prefix) is tried first, then the
+    primary v2 search; if both come back empty the remaining fallbacks race
+    concurrently and the first non-empty result wins. One map past `count` is looked
+    for, so a search that `count` actually cut short is reported on stderr and to `on_cut`.
+    """
+    limit = max(1, int(count)) if count else None
+    peek = limit + 1 if limit else None
+    memo = _SHARED_MEMO
+    if memo is not None:
+        key = ("maps", author.lower(), prefix.lower(), peek)
+        maps: Iterator[Dict[str, Any]] = iter(memo.get(key, lambda: list(_fetch_maps(author, prefix, user_agent, peek))))
+    else:
+        maps = _fetch_maps(author, prefix, user_agent, peek)
+    return _limited(maps, limit, author, prefix, on_cut)
+
+
+def _limited(
+    maps: Iterator[Dict[str, Any]],
+    limit: Optional[int],
+    author: str,
+    prefix: str,
+    on_cut: Optional[Callable[[int], None]],
+) -> Iterator[Dict[str, Any]]:
+    for i, m in enumerate(maps):
+        if limit is not None and i >= limit:
+            print(
+                f"Warning: map search for {author}/{prefix} stopped at the --max-maps limit of {limit}; later maps were not processed",
+                file=sys.stderr,
+            )
+            if on_cut is not None:
+                on_cut(limit)
+            return
+        yield m
+
+
+def _fetch_maps(author: str, prefix: str, user_agent: str, count: Optional[int]) -> Iterator[Dict[str, Any]]:
+    limit = max(1, int(count)) if count else None
+    # Be conservative with page size; docs default is 40.
+    per_page = min(limit or 100, 100)
+    first = [n for n in (_STRATEGY_MEMO.get(author, prefix), "v2") if n]
+    tried: List[str] = []
+    for name in dict.fromkeys(first):
+        tried.append(name)
+        found = 0
+        for m in itertools.islice(SEARCH_STRATEGIES[name](author, prefix, user_agent, per_page, threading.Event()), limit):
+            if found == 0:
+                _STRATEGY_MEMO.remember(author, prefix, name)
+            found += 1
+            yield m
+        if found:
+            return
+
+    fallbacks = [n for n in SEARCH_STRATEGIES if n not in tried]
+    name, maps = _race_strategies(fallbacks, author, prefix, user_agent, per_page, limit)
+    if name:
+        _STRATEGY_MEMO.remember(author, prefix, name)
+    yield from maps
+
+
+def fetch_replays(
+    track_id: int,
+    user_agent: str,
+    per_page: int = 200,
+) -> List[Dict[str, Any]]:
+    """Fetch all replays for a map, using best=1 to get leaderboard (Position field)."""
+    url = f"{TMX_BASE}/api/replays"
+    base_params = {
+        "mapId": str(track_id),
+        "count": str(per_page),
+        "best": "1",  # Get best replay per user (leaderboard)
+    }
+    collected: List[Dict[str, Any]] = []
+    after: Optional[int] = None
+    while True:
+        params = dict(base_params)
+        if after is not None:
+            params["after"] = str(after)
+        data = http_get(url, params, user_agent)
+        page = data.get("Results", [])
+        if page:
+            collected.extend(page)
+            last = page[-1].get("ReplayId")
+        else:
+            last = None
+        more = data.get("More", False)
+        if not more or not page or last is None:
+            break
+        try:
+            after = int(last)
+        except (TypeError, ValueError):
+            break
+    return collected
+
+
+def fetch_replays_fallback_get(track_id: int, user_agent: str, amount: int = 25) -> List[Dict[str, Any]]:
+    """Fallback to legacy endpoint to at least get top N replays if /api/replays yields none."""
+    url = f"{TMX_BASE}/api/replays/get_replays/{track_id}"
+    params = {"amount": str(amount)}
+    data = http_get(url, params, user_agent)
+    if isinstance(data, list):
+        return data
+    return []
+
+
+def _has_tops(data: Any) -> bool:
+    return isinstance(data, dict) and isinstance(data.get("tops"), list) and len(data["tops"]) > 0
+
+
+def _has_author_score(data: Any) -> bool:
+    return isinstance(data, dict) and data.get("authorScore") is not None
+
+
+# TMIO serves at most this many records per leaderboard request
+TMIO_PAGE = 100
+# Offset pages of one deep leaderboard requested at once; the per-host limiter still paces them
+LEADERBOARD_PAGE_WINDOW = 4
+
+
+def _is_page(data: Any) -> bool:
+    return isinstance(data, dict) and isinstance(data.get("tops"), list)
+
+
+def fetch_tmio_leaderboard(uid: str, user_agent: str, length: int = 50, fresh: bool = False) -> List[Dict[str, Any]]:
+    """Fetch top N records from trackmania.io leaderboard for a map UID; empty boards are retried within `http_get`'s budget.
+
+    `fresh` bypasses the response cache and the shared memo, for deliberate refetches.
+    """
+    memo = _SHARED_MEMO
+    if memo is not None and not fresh:
+        return memo.get(("tmio-lb", uid, length), lambda: _fetch_tmio_leaderboard(uid, user_agent, length))
+    return _fetch_tmio_leaderboard(uid, user_agent, length, fresh)
+
+
+def _fetch_tmio_page(uid: str, user_agent: str, offset: int, length: int, fresh: bool = False) -> List[Dict[str, Any]]:
+    """One leaderboard page. Only the first page treats an empty board as a transient
+    failure; past the end of the board, empty is the answer. A page that cannot be
+    fetched raises FetchError, so a failed board leaves the map missing rather than empty."""
+    url = f"{TMIO_BASE}/api/leaderboard/map/{uid}"
+    params = {"offset": str(offset), "length": str(length)}
+    try:
+        data = http_get(url, params, user_agent, accept=_has_tops if offset == 0 else _is_page, use_cache=not fresh)
+    except FetchError:
+        raise
+    except Exception as e:
+        raise FetchError(f"leaderboard {uid} offset {offset}: {e}") from e
+    if not _is_page(data):
+        raise FetchError(f"leaderboard {uid} offset {offset}: not a leaderboard page")
+    return data["tops"]
+
+
+def _fetch_tmio_leaderboard(uid: str, user_agent: str, length: int, fresh: bool = False) -> List[Dict[str, Any]]:
+    """Deeper than one page, the rest of the board is fetched as concurrent offset pages.
+
+    Windows of pages double in size (1, 2, 4, ... up to LEADERBOARD_PAGE_WINDOW), so a
+    board that ends just past the first page costs one extra request while a deep one is
+    fetched in parallel; the first short page marks the end of the leaderboard.
+    """
+    length = max(1, length)
+    tops = _fetch_tmio_page(uid, user_agent, 0, min(length, TMIO_PAGE), fresh)
+    if length <= TMIO_PAGE or len(tops) < TMIO_PAGE:
+        return tops
+    offsets = list(range(TMIO_PAGE, length, TMIO_PAGE))
+    size = 1
+    with ThreadPoolExecutor(max_workers=min(LEADERBOARD_PAGE_WINDOW, len(offsets))) as pool:
+        while offsets:
+            window, offsets = offsets[:size], offsets[size:]
+            size = min(LEADERBOARD_PAGE_WINDOW, size * 2)
+            pages = list(pool.map(lambda off: _fetch_tmio_page(uid, user_agent, off, min(TMIO_PAGE, length - off), fresh), window))
+            for off, page in zip(window, pages):
+                tops.extend(page)
+                if len(page) < min(TMIO_PAGE, length - off):
+                    return tops
+    return tops
+
+
+def fetch_tmio_author_time(uid: str, user_agent: str, fresh: bool = False) -> Optional[int]:
+    """Fetch author time (authorScore) in ms from trackmania.io for a map UID; a missing value is retried within `http_get`'s budget."""
+    memo = _SHARED_MEMO
+    if memo is not None and not fresh:
+        return memo.get(("tmio-at", uid), lambda: _fetch_tmio_author_time(uid, user_agent))
+    return _fetch_tmio_author_time(uid, user_agent, fresh)
+
+
+def _fetch_tmio_author_time(uid: str, user_agent: str, fresh: bool = False) -> Optional[int]:
+    """None only when TMIO answered without an author time; a failed request raises FetchError."""
+    url = f"{TMIO_BASE}/api/map/{uid}"
+    try:
+        data = http_get(url, {}, user_agent, accept=_has_author_score, use_cache=not fresh)
+    except FetchError:
+        raise
+    except Exception as e:
+        raise FetchError(f"map {uid}: {e}") from e
+    if not _has_author_score(data):
+        return None
+    try:
+        return int(data["authorScore"])
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,349 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from times_core import without_timing
+from times_net import http_send, replace_file
+
+
+def load_previous(path: str) -> Dict[str, Dict[str, Any]]:
+    """Index a previous output file's entries by UID."""
+    with open(path, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    return {e["uid"]: e for e in doc.get("maps") or [] if isinstance(e, dict) and e.get("uid")}
+
+
+def diff_summary(previous: Dict[str, Dict[str, Any]], maps: List[Dict[str, Any]]) -> List[str]:
+    """Describe how a regenerated map list differs from `previous`, one line per item."""
+    lines: List[str] = []
+    reused = changed = 0
+    seen = set()
+    for e in maps:
+        uid = e.get("uid")
+        seen.add(uid)
+        prev = previous.get(uid)
+        if prev is None:
+            lines.append(f"  + {e.get('name')} ({uid}): new map")
+            continue
+        if without_timing(e) == without_timing(prev):
+            reused += 1
+            continue
+        moved = []
+        for key in ("harderTime_ms", "medalTime_ms"):
+            old_v = (prev.get("computed") or {}).get(key)
+            new_v = (e.get("computed") or {}).get(key)
+            if old_v != new_v:
+                moved.append(f"{key} {old_v} -> {new_v}")
+        if moved:
+            changed += 1
+            lines.append(f"  ~ {e.get('name')} ({uid}): " + ", ".join(moved))
+    for uid, prev in previous.items():
+        if uid not in seen:
+            lines.append(f"  - {prev.get('name')} ({uid}): no longer listed")
+    recomputed = len(maps) - reused
+    lines.insert(0, f"Update: {reused} map(s) reused unchanged, {recomputed} recomputed, {changed} with moved medal times")
+    return lines
+
+
+# Fields the plugin's MedalData reads; everything else in an entry is provenance
+SLIM_FIELDS = ("uid", "trackId", "name", "authorTime_ms", "wrTime_ms", "recordsCount")
+SLIM_COMPUTED = ("harderTime_ms", "medalTime_ms", "method")
+
+
+def slim_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Project an entry onto the fields MedalData consumes, keeping their JSON shape."""
+    slim = {k: entry[k] for k in SLIM_FIELDS if entry.get(k) is not None}
+    comp = entry.get("computed") or {}
+    slim["computed"] = {k: comp[k] for k in SLIM_COMPUTED if comp.get(k) is not None}
+    return slim
+
+
+def audit_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """The complement of `slim_entry`: source URLs, hashes, intermediate times and so on."""
+    audit = {k: v for k, v in entry.items() if k not in SLIM_FIELDS and k != "computed"}
+    comp = {k: v for k, v in (entry.get("computed") or {}).items() if k not in SLIM_COMPUTED}
+    if comp:
+        audit["computed"] = comp
+    return audit
+
+
+def slim_document(out: Dict[str, Any]) -> Dict[str, Any]:
+    """Slim entries keyed by UID with a sorted UID index, for the plugin's session-start fetch."""
+    by_uid = {e["uid"]: slim_entry(e) for e in out.get("maps") or [] if e.get("uid")}
+    index = sorted(by_uid)
+    return {
+        "author": out.get("author"),
+        "prefix": out.get("prefix"),
+        "generated_at": out.get("generated_at"),
+        "count": len(index),
+        "index": index,
+        "maps": {uid: by_uid[uid] for uid in index},
+    }
+
+
+def audit_document(out: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "author": out.get("author"),
+        "prefix": out.get("prefix"),
+        "generated_at": out.get("generated_at"),
+        "maps": {e["uid"]: audit_entry(e) for e in out.get("maps") or [] if e.get("uid")},
+    }
+
+
+def write_slim(doc: Dict[str, Any], path: str, with_gzip: bool = False) -> List[str]:
+    """Write compact JSON (and `path`.gz when asked); returns the paths written."""
+    data = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    written = [path]
+    if with_gzip:
+        # mtime=0 keeps the archive byte-identical across runs with the same content
+        with open(path + ".gz", "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9, mtime=0) as gz:
+            gz.write(data)
+        written.append(path + ".gz")
+    return written
+
+
+# Bumped when the bundle layout changes; the plugin ignores bundles of another format
+BUNDLE_FORMAT = 1
+
+
+def bundle_document(out: Dict[str, Any]) -> Dict[str, Any]:
+    """The per-campaign medal bundle the plugin loads into its cache in one step at session start.
+
+    `payload` is the slim UID -> entry map as a compact ASCII JSON string, so its checksum
+    survives transports that re-serialize the outer JSON (Firebase does). `sha256` is the
+    payload's digest and `version` its first 16 hex digits: a bundle only gets a new
+    version when some map's medal data changed, and the plugin compares versions to tell
+    whether the one it holds is stale.
+    """
+    maps = slim_document(out)["maps"]
+    payload = json.dumps(maps, ensure_ascii=True, separators=(",", ":"), sort_keys=True)
+    digest = hashlib.sha256(payload.encode("ascii")).hexdigest()
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": digest[:16],
+        "sha256": digest,
+        "author": out.get("author"),
+        "prefix": out.get("prefix"),
+        "generated_at": out.get("generated_at"),
+        "count": len(maps),
+        "payload": payload,
+    }
+
+
+def bundle_gaps(out: Dict[str, Any]) -> List[str]:
+    """Why `out` does not cover its whole campaign. The plugin trusts a current bundle
+    completely, so a bundle built from such a document would hide the maps it lacks."""
+    gaps: List[str] = []
+    if out.get("missing"):
+        gaps.append(f"{len(out['missing'])} map(s) missing")
+    if out.get("truncated"):
+        gaps.append(f"the map search stopped at --max-maps {out['truncated']}")
+    if out.get("shard"):
+        gaps.append(f"shard {out['shard']['index']}/{out['shard']['count']} holds only its own maps (use `merge --bundle`)")
+    return gaps
+
+
+def write_bundle(out: Dict[str, Any], path: str) -> bool:
+    """Write `out`'s bundle to `path`, or refuse (returning False) when `bundle_gaps` finds any."""
+    gaps = bundle_gaps(out)
+    if gaps:
+        print(f"Bundle: not writing {path}: " + "; ".join(gaps), file=sys.stderr)
+        return False
+    bundle = bundle_document(out)
+    write_slim(bundle, path)
+    print(f"Bundle: wrote {path} (version {bundle['version']}, {bundle['count']} map(s))", file=sys.stderr)
+    return True
+
+
+def _strip_nulls(value: Any) -> Any:
+    """Drop None values recursively; Firebase never stores nulls, so they would always look changed."""
+    if isinstance(value, dict):
+        return {k: _strip_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_strip_nulls(v) for v in value if v is not None]
+    return value
+
+
+def fetch_node(base_url: str, user_agent: str, auth_token: Optional[str] = None) -> Dict[str, Any]:
+    """The published UID -> slim entry node at `base_url`; empty if there is none yet."""
+    params = {"auth": auth_token} if auth_token else None
+    found = http_send("GET", base_url.rstrip("/") + ".json", user_agent, params=params)
+    return found if isinstance(found, dict) else {}
+
+
+def published_document(out: Dict[str, Any], remote: Dict[str, Any]) -> Dict[str, Any]:
+    """`out` with its maps replaced by everything published at the node (`remote`, as kept
+    up to date by `publish_entries`), so a bundle built from it covers maps this run
+    skipped, failed or never reached instead of dropping them."""
+    return dict(out, maps=[dict(v, uid=uid) for uid, v in remote.items() if isinstance(v, dict)])
+
+
+def held_back(entry: Dict[str, Any], remote: Dict[str, Any]) -> bool:
+    """Whether publishing `entry` would replace data the plugin can use with data it can't.
+
+    Entries without an author time are rejected by the plugin's `MedalData.IsValid`, so
+    they are never sent. An unresolved retry keeps the remote copy when there is one.
+    """
+    if int(entry.get("authorTime_ms") or 0) <= 0:
+        return True
+    retried = entry.get("retried")
+    return bool(retried) and not retried.get("resolved") and remote.get(entry.get("uid")) is not None
+
+
+def publish_entries(
+    base_url: str,
+    entries: List[Dict[str, Any]],
+    user_agent: str,
+    auth_token: Optional[str] = None,
+    chunk_size: int = 100,
+    remote: Optional[Dict[str, Any]] = None,
+) -> Dict[str, int]:
+    """Publish entries to a Firebase node keyed by UID, writing only what differs remotely.
+
+    Only the slim projection is stored, so the plugin's bulk fetch of the node stays small.
+
+    The node is read once; changed UIDs are sent as multi-path PATCH requests of at most
+    `chunk_size` entries each, so a full campaign is one GET plus one or a few writes.
+    A caller that already knows the node's contents passes them as `remote` to skip the
+    GET; that dict is updated with whatever gets written. Entries `held_back` are not
+    sent and are counted as "held".
+    """
+    node_url = base_url.rstrip("/") + ".json"
+    params = {"auth": auth_token} if auth_token else None
+    if remote is None:
+        remote = fetch_node(base_url, user_agent, auth_token)
+
+    changed: Dict[str, Any] = {}
+    held = 0
+    for e in entries:
+        uid = e.get("uid")
+        if not uid:
+            continue
+        if held_back(e, remote):
+            held += 1
+            continue
+        value = _strip_nulls(slim_entry(e))
+        if remote.get(uid) != value:
+            changed[uid] = value
+
+    uids = list(changed)
+    step = max(1, int(chunk_size))
+    writes = 0
+    for i in range(0, len(uids), step):
+        http_send("PATCH", node_url, user_agent, params=params, payload={u: changed[u] for u in uids[i:i + step]})
+        remote.update((u, changed[u]) for u in uids[i:i + step])
+        writes += 1
+    return {"remote": len(remote), "local": len(entries), "changed": len(changed), "held": held, "writes": writes}
+
+
+def bundle_url(base_url: str) -> str:
+    """Firebase node the bundle for `base_url`'s entries lives at: a sibling, so bulk reads of the entries don't pull it."""
+    return base_url.rstrip("/") + "_bundle"
+
+
+def publish_bundle(base_url: str, bundle: Dict[str, Any], user_agent: str, auth_token: Optional[str] = None) -> bool:
+    """PUT `bundle` next to the entries at `base_url` unless the published one has the same version."""
+    node = bundle_url(base_url)
+    params = {"auth": auth_token} if auth_token else None
+    if http_send("GET", node + "/version.json", user_agent, params=params) == bundle["version"]:
+        return False
+    http_send("PUT", node + ".json", user_agent, params=params, payload=bundle)
+    return True
+
+
+class StreamWriter:
+    """Append-only NDJSON output with a UID journal for checkpoint/resume.
+
+    The stream starts with a `{"header": ...}` line followed by one `{"index", "entry"}`
+    line per map. A UID is appended to `<path>.journal` only after its entry line has
+    been flushed, so every journaled map is guaranteed to be in the stream.
+    """
+
+    def __init__(self, path: str, header: Dict[str, Any], resume: bool = False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.done: set = set()
+        self.header = header
+        if resume and os.path.exists(path):
+            _truncate_torn_line(path)
+            _truncate_torn_line(self.journal_path)
+            existing, _ = read_stream(path)
+            if existing:
+                self.header = existing
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "r", encoding="utf-8") as f:
+                    self.done = {line.strip() for line in f if line.strip()}
+            self._stream = open(path, "a", encoding="utf-8")
+        else:
+            self._stream = open(path, "w", encoding="utf-8")
+            self._stream.write(json.dumps({"header": header}, ensure_ascii=False) + "\n")
+            self._stream.flush()
+            with open(self.journal_path, "w", encoding="utf-8"):
+                pass
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def write(self, index: int, entry: Dict[str, Any]) -> None:
+        self._stream.write(json.dumps({"index": index, "entry": entry}, ensure_ascii=False) + "\n")
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._journal.write(entry["uid"] + "\n")
+        self._journal.flush()
+        self.done.add(entry["uid"])
+
+    def close(self) -> None:
+        self._stream.close()
+        self._journal.close()
+
+
+def _truncate_torn_line(path: str) -> None:
+    """Cut a file back to its last newline, dropping a line half-written by an interrupted run."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        keep = data.rfind(b"\n") + 1
+        if keep < len(data):
+            f.truncate(keep)
+
+
+def read_stream(path: str) -> Tuple[Optional[Dict[str, Any]], List[Tuple[int, Dict[str, Any]]]]:
+    """Return (header, [(index, entry)]) from an NDJSON stream, ignoring a torn last line."""
+    header: Optional[Dict[str, Any]] = None
+    rows: List[Tuple[int, Dict[str, Any]]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "header" in rec:
+                header = rec["header"]
+            elif isinstance(rec.get("entry"), dict):
+                rows.append((int(rec.get("index") or 0), rec["entry"]))
+    return header, rows
+
+
+def document_from_stream(path: str) -> Dict[str, Any]:
+    """Build the regular output document from a stream: maps in discovery order, last write per UID wins."""
+    header, rows = read_stream(path)
+    latest: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+    for line_no, (index, entry) in enumerate(rows):
+        latest[entry.get("uid")] = (index, line_no, entry)
+    ordered = sorted(latest.values(), key=lambda r: (r[0], r[1]))
+    out = dict(header or {})
+    out["maps"] = [entry for _, _, entry in ordered]
+    return out
+
+
+def write_document(out: Dict[str, Any], path: str) -> None:
+    """Write `out` as JSON to `path` ("-" for stdout); files are replaced atomically."""
+    if path == "-":
+        json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        replace_file(path, lambda f: json.dump(out, f, ensure_ascii=False, indent=2))